@@ -2,6 +2,15 @@ import asyncio
 from asyncio import StreamWriter, StreamReader, AbstractEventLoop
 
 
+from DataTransfer.Audio.ActiveSpeakerDetector import ActiveSpeakerDetector
+from DataTransfer.Audio.AudioCodec import AudioEncoder, AudioDecoder
+from DataTransfer.Audio.AudioFEC import FecEncoder, FecDecoder
+from DataTransfer.Audio.AudioMixer import AudioMixer
+from DataTransfer.Audio.AudioPacket import AudioPacket, pack_audio, timestamp_ms, FLAG_COMFORT_NOISE, FLAG_FEC
+from DataTransfer.Audio.ReorderBuffer import ReorderBuffer
+from DataTransfer.Video.LayerSelector import LayerSelector
+from DataTransfer.Video.PacketHistory import PacketHistory
+from DataTransfer.Video.VideoPacket import VideoPacket, FLAG_RETRANSMISSION
 from Protocol.AudioProtocol import AudioProtocol
 from Protocol.VideoProtocol import VideoProtocol
 from common.user import *
@@ -17,7 +26,28 @@ class ConferenceServer:
         self.conf_serve_port: int = conf_serve_port
         self.data_serve_ports = {}
         self.data_types: List[str] = ['video', 'audio', 'text']
-        self.mixed_audio_buffer = {}
+        self.audio_mixer = AudioMixer()
+        self.audio_decoders: Dict[Tuple[str, int], AudioDecoder] = {}  # decoders for clients sending encoded audio
+        self.audio_encoders: Dict[Tuple[str, int], AudioEncoder] = {}  # encoders for clients receiving encoded audio
+        self.audio_sequences: Dict[Tuple[str, int], int] = {}  # sequence number of the mix sent to each client
+        self.audio_rates: Dict[Tuple[str, int], int] = {}  # sampling rate of the PCM each client sends
+        self.audio_fec_decoders: Dict[Tuple[str, int], FecDecoder] = {}  # rebuild packets lost on the way up
+        self.audio_fec_encoders: Dict[Tuple[str, int], FecEncoder] = {}  # protect the mix of clients asking for FEC
+        # put what each sender sends back in order, holding it for packets rebuilt from FEC parity
+        self.audio_reorder_buffers: Dict[Tuple[str, int], ReorderBuffer] = {}
+        self.audio_mix_id: bytes = str(conference_id).encode('utf-8')  # participant id of the mixed stream
+        self.speaker_detector = ActiveSpeakerDetector()
+        # client ids of the current speakers, loudest first, their video gets a larger share of every downlink
+        self.active_speakers: List[str] = []
+        self.client_names: Dict[str, str] = {}  # self.client_names[client_id] = username
+        self.layer_selector = LayerSelector()  # simulcast layer forwarded from each sender to each receiver
+        self.keyframe_requests: Dict[Tuple[Tuple[str, int], int], float] = {}  # last request sent per (sender, layer)
+        # video chunks forwarded lately, keyed by (sender addr, layer, frame id, chunk index), to answer NACKs
+        self.video_cache = PacketHistory(VIDEO_FORWARD_CACHE_SIZE)
+        # receivers waiting for a chunk asked again from its sender, and when it was asked
+        self.pending_nacks: Dict[Tuple, Tuple[Set[Tuple[str, int]], float]] = {}
+        # (sender addr, receiver addr) of the streams a receiver does not show, only their keyframes are forwarded
+        self.paused_video: Set[Tuple[Tuple[str, int], Tuple[str, int]]] = set()
         self.clients_info = []
         self.client_conns_text = {}  # self.client_conns_text[client_id] = (reader, writer), This is for text data like quit, init, and text message
         """
@@ -46,7 +76,7 @@ class ConferenceServer:
         client_id = None
         try:
             while self.running:
-                data = await reader.read(CONTROL_LINE_BUFFER)
+                data = await reader.readline()
                 if not data:
                     break
                 message = data.decode()
@@ -56,9 +86,11 @@ class ConferenceServer:
                     break
                 elif request['type'] == MessageType.INIT.value:
                     client_id = request['client_id']
+                    self.client_names[client_id] = request.get('client_name', client_id)
                     self.client_conns_text[client_id] = (reader, writer)
                     self.clients_addr['text'][client_id] = addr
                     self.clients_info.append(addr)
+                    await self.notify_participants()
                     await self.switch_mode()
                 elif request['type'] == MessageType.TEXT_MESSAGE.value:
                     sender_name = request.get('sender_name', 'undefined')
@@ -77,7 +109,7 @@ class ConferenceServer:
                     }
                     for _, self_writer in self.client_conns_text.values():
                         if self_writer != writer:
-                            self_writer.write(json.dumps(message).encode())
+                            self_writer.write(pack_message(message))
                             await self_writer.drain()
                 else:
                     print(f"Unknown message: {message}")
@@ -90,7 +122,7 @@ class ConferenceServer:
             # judge if the writer is closed
             if not writer.is_closing():
                 try:
-                    writer.write(b'Cancelled')
+                    writer.write(b'Cancelled' + TEXT_DELIMITER)
                     await writer.drain()
                 except (ConnectionResetError, BrokenPipeError):
                     print(f"Failed to send 'Cancelled' message to {addr} because the connection was closed.")
@@ -105,6 +137,7 @@ class ConferenceServer:
             if self.running and client_id == self.manager_id:
                 asyncio.run_coroutine_threadsafe(self.stop(), self.loop)
             if self.running and client_id != self.manager_id:
+                asyncio.run_coroutine_threadsafe(self.notify_participants(), self.loop)
                 asyncio.run_coroutine_threadsafe(self.switch_mode(), self.loop)
 
     def remove_client(self, client_id: str):
@@ -117,7 +150,25 @@ class ConferenceServer:
         if self.clients_addr['text'].get(client_id) in self.clients_info:
             self.clients_info.remove(self.clients_addr['text'][client_id])
         if self.clients_addr['audio'].get(client_id):
-            self.mixed_audio_buffer.pop(self.clients_addr['audio'][client_id], None)
+            audio_addr = self.clients_addr['audio'][client_id]
+            self.audio_mixer.remove_listener(audio_addr)
+            self.audio_decoders.pop(audio_addr, None)
+            self.audio_encoders.pop(audio_addr, None)
+            self.audio_sequences.pop(audio_addr, None)
+            self.audio_rates.pop(audio_addr, None)
+            self.audio_fec_decoders.pop(audio_addr, None)
+            self.audio_fec_encoders.pop(audio_addr, None)
+            self.audio_reorder_buffers.pop(audio_addr, None)
+            self.speaker_detector.remove(audio_addr)
+        if self.clients_addr['video'].get(client_id):
+            video_addr = self.clients_addr['video'][client_id]
+            self.layer_selector.remove(video_addr)
+            for key in [key for key in self.keyframe_requests if key[0] == video_addr]:
+                del self.keyframe_requests[key]
+            for key in [key for key in self.pending_nacks if key[0] == video_addr]:
+                del self.pending_nacks[key]
+            self.paused_video = {pair for pair in self.paused_video if video_addr not in pair}
+        self.client_names.pop(client_id, None)
         for datatype in self.data_types:
             self.clients_addr[datatype].pop(client_id, None)
 
@@ -134,14 +185,14 @@ class ConferenceServer:
             self.mode = DistributeProtocol.CLIENT_SERVER.value
             writer = list(self.client_conns_text.values())[0][1]
             message = {'type': MessageType.SWITCH_TO_CS.value}
-            writer.write(json.dumps(message).encode())
+            writer.write(pack_message(message))
             await writer.drain()
         # If there are only two clients in the conference, switch to peer-to-peer mode
         elif num_clients == 2:
             self.mode = DistributeProtocol.PEER_TO_PEER.value
             # Notify all clients to switch to peer-to-peer mode
             for reader, writer in self.client_conns_text.values():
-                writer.write(json.dumps({'type': MessageType.SWITCH_TO_P2P.value}).encode())
+                writer.write(pack_message({'type': MessageType.SWITCH_TO_P2P.value}))
                 await writer.drain()
         # If there are more than two clients in the conference, switch to client-server mode
         elif num_clients > 2:
@@ -152,7 +203,7 @@ class ConferenceServer:
             self.mode = DistributeProtocol.CLIENT_SERVER.value
             message = {'type': MessageType.SWITCH_TO_CS.value}
             for reader, writer in self.client_conns_text.values():
-                writer.write(json.dumps(message).encode())
+                writer.write(pack_message(message))
                 await writer.drain()
 
     async def emit_message(self, message: str, sender_name: str, timestamp: str, sender: StreamWriter):
@@ -167,39 +218,310 @@ class ConferenceServer:
         }
         for client_reader, client_writer in self.client_conns_text.values():
             if client_writer != sender:
-                client_writer.write(json.dumps(emit_message).encode())
+                client_writer.write(pack_message(emit_message))
                 await client_writer.drain()
 
-    async def handle_video(self, data, addr):
+    async def handle_video(self, data, packet: VideoPacket, addr):
         """
         Handle video data from clients.
+        Every receiver only gets the simulcast layer chosen for it by the layer selector.
+        :param data: bytes, the datagram, forwarded as is
+        :param packet: VideoPacket, its parsed header
         :param addr: tuple[ip, port]
-        :param data: bytes
         :return:
         """
+        key = (addr, packet.layer, packet.frame_id, packet.sequence_number)
+        self.video_cache.put(key, data)
+        if packet.flags & FLAG_RETRANSMISSION:
+            # only the receivers that asked for it need a retransmitted chunk
+            requesters, _ = self.pending_nacks.pop(key, (set(), 0.0))
+            for client_addr in requesters:
+                self.transport['video'].sendto(data, client_addr)
+            return
         for client_addr in self.clients_addr['video'].values():
             if client_addr == addr:
                 continue
-            self.transport['video'].sendto(data, client_addr)
+            if (addr, client_addr) in self.paused_video and not packet.is_keyframe:
+                continue
+            if self.layer_selector.forward(addr, client_addr, packet):
+                self.transport['video'].sendto(data, client_addr)
             # print(f"Sending video data to {client_addr}")
+            if packet.sequence_number == 0:
+                # a receiver waiting to switch layers does not have to wait for the next periodic keyframe
+                layer = self.layer_selector.wants_keyframe(addr, client_addr)
+                if layer is not None:
+                    self.request_keyframe(addr, layer)
+
+    def request_keyframe(self, sender_addr, layer: int):
+        """
+        Ask a sender for a keyframe of a layer.
+        Requests of all receivers are merged, at most one per VIDEO_KEYFRAME_REQUEST_INTERVAL reaches the sender.
+        :param sender_addr: tuple[ip, port]
+        :param layer: int
+        """
+        now = self.loop.time()
+        if now - self.keyframe_requests.get((sender_addr, layer), -VIDEO_KEYFRAME_REQUEST_INTERVAL) \
+                < VIDEO_KEYFRAME_REQUEST_INTERVAL:
+            return
+        self.keyframe_requests[sender_addr, layer] = now
+        message = {'type': MessageType.KEYFRAME_REQUEST.value, 'layer': layer}
+        self.transport['video'].sendto(json.dumps(message).encode(), sender_addr)
+
+    def handle_nack(self, request: dict, addr):
+        """
+        Handle a NACK of a receiver missing some chunks of a frame.
+        Chunks lost on the way down are sent again from the forwarding cache, the others are asked
+        from the sender once for all the receivers missing them.
+        :param request: dict, client_id is the sender, with the layer, frame_id and sequences missing
+        :param addr: tuple[ip, port]
+        """
+        sender_addr = self.clients_addr['video'].get(request.get('client_id'))
+        if sender_addr is None:
+            return
+        layer, frame_id = request.get('layer'), request.get('frame_id')
+        now = self.loop.time()
+        upstream = []
+        for sequence_number in request.get('sequences', []):
+            key = (sender_addr, layer, frame_id, sequence_number)
+            data = self.video_cache.get(key)
+            if data is not None:
+                self.transport['video'].sendto(data, addr)
+                continue
+            requesters, asked_at = self.pending_nacks.get(key, (set(), None))
+            requesters.add(addr)
+            if asked_at is None or now - asked_at >= VIDEO_NACK_INTERVAL:
+                asked_at = now
+                upstream.append(sequence_number)
+            self.pending_nacks[key] = (requesters, asked_at)
+        while len(self.pending_nacks) > VIDEO_FORWARD_CACHE_SIZE:
+            # retransmissions that never came
+            del self.pending_nacks[next(iter(self.pending_nacks))]
+        if upstream:
+            message = {
+                'type': MessageType.NACK.value,
+                'layer': layer,
+                'frame_id': frame_id,
+                'sequences': upstream,
+            }
+            self.transport['video'].sendto(json.dumps(message).encode(), sender_addr)
+
+    def handle_keyframe_request(self, request: dict, addr):
+        """
+        Handle a keyframe request (PLI) of a receiver that lost part of a stream.
+        :param request: dict, client_id is the sender of the broken stream
+        :param addr: tuple[ip, port]
+        """
+        sender_addr = self.clients_addr['video'].get(request.get('client_id'))
+        if sender_addr is None:
+            return
+        layer = self.layer_selector.current.get((sender_addr, addr))
+        if layer is None:
+            layer = self.layer_selector.target_layer(sender_addr, addr)
+        self.request_keyframe(sender_addr, layer)
+
+    def handle_video_pause(self, request: dict, addr):
+        """
+        Handle a receiver pausing or resuming a stream it does not show (window minimised, no tile left).
+        A paused stream still gets its keyframes, the receiver asks for one when it resumes.
+        :param request: dict, client_id is the sender, paused is True to pause and False to resume
+        :param addr: tuple[ip, port]
+        """
+        sender_addr = self.clients_addr['video'].get(request.get('client_id'))
+        if sender_addr is None or sender_addr == addr:
+            return
+        if request.get('paused'):
+            self.paused_video.add((sender_addr, addr))
+        else:
+            self.paused_video.discard((sender_addr, addr))
+
+    def handle_video_report(self, report: dict, addr):
+        """
+        Handle a receiver report: the tile size a client shows each stream at, its downlink bandwidth,
+        and the loss, jitter and bit rate of every stream it receives.
+        :param report: dict
+        :param addr: tuple[ip, port]
+        """
+        try:
+            tile_width, tile_height = report['tile']
+            self.layer_selector.update_report(addr, int(tile_width), int(tile_height),
+                                              int(report.get('bandwidth', VIDEO_DOWNLINK_BANDWIDTH)))
+        except (KeyError, TypeError, ValueError):
+            print(f"[Error]: Invalid receiver report from {addr}")
+            return
+        # forward the statistics of each stream to its sender, which adapts its bit rate
+        for client_id, statistics in report.get('streams', {}).items():
+            sender_addr = self.clients_addr['video'].get(client_id)
+            if sender_addr is None or sender_addr == addr:
+                continue
+            message = {
+                'type': MessageType.RECEIVER_REPORT.value,
+                'streams': {client_id: statistics},
+            }
+            self.transport['video'].sendto(json.dumps(message).encode(), sender_addr)
+
+    def init_audio_codec(self, addr, codec: str, bit_rate: int, fec_group: int = 0, rate: int = RATE,
+                         output_rate: int = RATE):
+        """
+        Add a client to the mixer with the codec it chose to receive the mix in when joining, raw PCM needs no codec.
+        What a client sends is decoded according to the payload type of each packet.
+        :param addr: tuple[ip, port]
+        :param codec: str, 'pcm' or one of AudioCodec.SUPPORTED_CODECS
+        :param bit_rate: int
+        :param fec_group: int, packets per parity packet of the mix, 0 to send no parity
+        :param rate: int, sampling rate of the raw PCM the client sends
+        :param output_rate: int, sampling rate the client plays the mix at
+        """
+        self.audio_sequences[addr] = 0
+        self.audio_rates[addr] = rate
+        # the client protects what it sends with the same group size
+        self.audio_reorder_buffers[addr] = ReorderBuffer(fec_group)
+        if fec_group > 0:
+            self.audio_fec_encoders[addr] = FecEncoder(fec_group)
+        if codec != 'pcm':
+            try:
+                # the encoder takes the mixer bus as is, the client's decoder outputs the rate it plays at
+                self.audio_encoders[addr] = AudioEncoder(codec, bit_rate, self.audio_mixer.rate)
+                self.audio_mixer.add_listener(addr)
+                return
+            except ValueError as e:
+                print(f"[Error]: {e}, falling back to PCM for {addr}")
+        # raw PCM is resampled to the rate the client plays at
+        self.audio_mixer.add_listener(addr, output_rate)
 
-    async def handle_audio(self, data, addr):
+    async def handle_audio(self, packet: AudioPacket, addr):
         """
         Handle audio data from clients.
-        :param data: bytes
+        The frame is only decoded and queued here, mixing is driven by the clock in mix_audio.
+        :param packet: AudioPacket
         :param addr: tuple[ip, port]
         :return:
         """
-        for client_addr in self.clients_addr['audio'].values():
-            if client_addr == addr:
+        reorder_buffer = self.audio_reorder_buffers.get(addr)
+        if reorder_buffer is None:
+            reorder_buffer = self.audio_reorder_buffers[addr] = ReorderBuffer()
+        if packet.flags & FLAG_COMFORT_NOISE:
+            # keepalive of a sender in silence, nothing to mix, and what waits behind a gap is too old now
+            reorder_buffer.clear()
+            return
+        fec_decoder = self.audio_fec_decoders.get(addr)
+        if fec_decoder is None:
+            fec_decoder = self.audio_fec_decoders[addr] = FecDecoder()
+        if packet.flags & FLAG_FEC:
+            recovered = fec_decoder.add_parity(packet)
+            packets = [recovered] if recovered else []
+        else:
+            recovered = fec_decoder.add_data(packet)
+            packets = [packet, recovered] if recovered else [packet]
+        # a packet rebuilt from the parity fills its gap in the reorder buffer before it is mixed
+        packets = [ready for packet in packets for ready in reorder_buffer.push(packet)]
+        for packet in packets:
+            if packet.codec == 'pcm':
+                self.audio_mixer.push(addr, packet.payload, self.audio_rates.get(addr, RATE))
                 continue
-            data = data.ljust(CHUNK * 2, b'\x00')
-            mixed_audio = np.add(self.mixed_audio_buffer[client_addr], np.frombuffer(data, dtype=np.int16),
-                                 casting="unsafe")
-            mixed_audio = np.clip(mixed_audio, -32768, 32767)
-            self.mixed_audio_buffer[client_addr] = mixed_audio
-        self.transport['audio'].sendto(self.mixed_audio_buffer[addr].tobytes(), addr)
-        self.mixed_audio_buffer[addr] = np.zeros(CHUNK, dtype=np.int16)
+            decoder = self.audio_decoders.get(addr)
+            if decoder is None or decoder.codec != packet.codec:
+                # decode straight to the mixer rate, no second resampling pass
+                decoder = self.audio_decoders[addr] = AudioDecoder(packet.codec, self.audio_mixer.rate)
+            self.audio_mixer.push(addr, decoder.decode(packet.payload))
+
+    def send_audio_parity(self, addr, parity: Optional[Tuple[int, bytes]], codec: str):
+        """
+        Send the parity packet of a completed FEC group of the mix sent to a client.
+        :param addr: tuple[ip, port]
+        :param parity: (first sequence number, parity payload) or None
+        :param codec: str, payload type of the protected packets
+        """
+        if parity is None:
+            return
+        first_sequence, payload = parity
+        self.transport['audio'].sendto(
+            pack_audio(self.audio_mix_id, first_sequence, timestamp_ms(), payload, codec, FLAG_FEC), addr)
+
+    async def mix_audio(self):
+        """
+        Mixing scheduler: every frame period pull one frame from each sender, mix,
+        and push the result to every listener whether or not that listener is sending.
+        """
+        period = self.audio_mixer.frame_size / self.audio_mixer.rate
+        next_tick = self.loop.time()
+        try:
+            while self.running:
+                timestamp = timestamp_ms()
+                mixed = self.audio_mixer.mix()
+                for client_addr, mixed_audio in mixed.items():
+                    codec = 'pcm'
+                    encoder = self.audio_encoders.get(client_addr)
+                    if encoder:
+                        codec = encoder.codec
+                        mixed_audio = encoder.encode(mixed_audio)
+                        if not mixed_audio:
+                            continue
+                    sequence_number = self.audio_sequences.get(client_addr, 0)
+                    self.audio_sequences[client_addr] = sequence_number + 1
+                    self.transport['audio'].sendto(
+                        pack_audio(self.audio_mix_id, sequence_number, timestamp, mixed_audio, codec), client_addr)
+                    fec_encoder = self.audio_fec_encoders.get(client_addr)
+                    if fec_encoder:
+                        self.send_audio_parity(client_addr,
+                                               fec_encoder.protect(sequence_number, timestamp, mixed_audio), codec)
+                for client_addr, fec_encoder in self.audio_fec_encoders.items():
+                    if client_addr not in mixed:
+                        # nobody speaks, close the partial group instead of holding it back
+                        self.send_audio_parity(client_addr, fec_encoder.flush(),
+                                               self.audio_encoders[client_addr].codec
+                                               if client_addr in self.audio_encoders else 'pcm')
+                if self.speaker_detector.update(self.audio_mixer.contributions):
+                    self.loop.create_task(self.notify_active_speaker())
+                next_tick += period
+                delay = next_tick - self.loop.time()
+                if delay < -period:
+                    # fell too far behind (e.g. the loop was blocked), do not burst to catch up
+                    next_tick = self.loop.time()
+                await asyncio.sleep(max(0.0, delay))
+        except asyncio.CancelledError:
+            pass
+
+    async def notify_active_speaker(self):
+        """
+        Prefer the video of the ranked speakers in the layer selection, and push the new dominant speaker
+        and the speaker ranking to all clients over the text channel.
+        """
+        audio_clients = {addr: client_id for client_id, addr in self.clients_addr['audio'].items()}
+        self.active_speakers = [audio_clients[addr] for addr in self.speaker_detector.ranking(ACTIVE_SPEAKER_COUNT)
+                                if addr in audio_clients]
+        self.layer_selector.set_speakers(self.clients_addr['video'][client_id] for client_id in self.active_speakers
+                                         if client_id in self.clients_addr['video'])
+        speaker_id = audio_clients.get(self.speaker_detector.dominant)
+        if speaker_id is None:
+            return
+        message = {
+            'type': MessageType.ACTIVE_SPEAKER.value,
+            'client_id': speaker_id,
+            'active_speakers': self.active_speakers
+        }
+        await self.broadcast(message)
+
+    async def notify_participants(self):
+        """
+        Push the participant list to all clients when someone joins or leaves, the active speaker
+        notifications refer to its client ids.
+        """
+        message = {
+            'type': MessageType.PARTICIPANTS.value,
+            'participants': [{'client_id': client_id, 'name': name} for client_id, name in self.client_names.items()]
+        }
+        await self.broadcast(message)
+
+    async def broadcast(self, message: dict):
+        """
+        Send a message to all clients over the text channel.
+        """
+        for _, client_writer in list(self.client_conns_text.values()):
+            try:
+                client_writer.write(pack_message(message))
+                await client_writer.drain()
+            except (ConnectionResetError, BrokenPipeError):
+                pass
 
     async def log(self):
         try:
@@ -242,6 +564,7 @@ class ConferenceServer:
         self.transport['video'], _ = self.loop.run_until_complete(video_server_coro)
         self.transport['audio'], _ = self.loop.run_until_complete(audio_server_coro)
         self.loop.create_task(self.log())
+        self.loop.create_task(self.mix_audio())
         try:
             self.loop.run_forever()
         except KeyboardInterrupt:
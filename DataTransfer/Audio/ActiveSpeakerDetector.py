@@ -0,0 +1,83 @@
+from typing import *
+
+import numpy as np
+
+from DataTransfer.Audio.VoiceActivityDetector import MIN_SPEECH_LEVEL
+from config import AUDIO_FRAME_MS, ACTIVE_SPEAKER_SMOOTHING, ACTIVE_SPEAKER_HYSTERESIS, ACTIVE_SPEAKER_HOLD
+
+SILENCE_LEVEL = -96.0
+
+
+def samples_level(samples: np.ndarray) -> float:
+    """
+    RMS level of int16 samples in dBFS
+    """
+    power = np.mean(np.square(samples, dtype=np.float32)) / (32768.0 * 32768.0)
+    return max(10 * np.log10(power), SILENCE_LEVEL) if power > 0 else SILENCE_LEVEL
+
+
+class ActiveSpeakerDetector:
+    """
+    Rank participants by their smoothed audio level and track the dominant speaker.
+
+    A challenger only takes over when it stays `hysteresis` dB above the current dominant
+    speaker for `hold` ms, so short interjections and noise bursts do not flip the speaker.
+    """
+
+    def __init__(self, frame_ms: int = AUDIO_FRAME_MS, smoothing: int = ACTIVE_SPEAKER_SMOOTHING,
+                 hysteresis: float = ACTIVE_SPEAKER_HYSTERESIS, hold: int = ACTIVE_SPEAKER_HOLD):
+        self.alpha = min(1.0, frame_ms / smoothing)
+        self.hysteresis = hysteresis
+        self.hold_ticks = max(1, hold // frame_ms)
+        self.levels: Dict[Hashable, float] = {}  # levels[participant] = smoothed level in dBFS
+        self.dominant: Optional[Hashable] = None
+        self._challenger: Optional[Hashable] = None
+        self._challenge_ticks = 0
+
+    def remove(self, key: Hashable):
+        self.levels.pop(key, None)
+        if self.dominant == key:
+            self.dominant = None
+        if self._challenger == key:
+            self._challenger = None
+
+    def update(self, frames: Dict[Hashable, np.ndarray]) -> bool:
+        """
+        feed the frames of one mixing tick, participants without a frame are silent
+        :param frames: dict, participant -> int16 samples
+        :return: bool, True if the dominant speaker changed
+        """
+        for key in frames.keys() | self.levels.keys():
+            level = samples_level(frames[key]) if key in frames else SILENCE_LEVEL
+            previous = self.levels.get(key, SILENCE_LEVEL)
+            self.levels[key] = previous + self.alpha * (level - previous)
+        if not self.levels:
+            return False
+
+        best = max(self.levels, key=self.levels.get)
+        if self.dominant is None:
+            if self.levels[best] > MIN_SPEECH_LEVEL:
+                self.dominant = best
+                return True
+            return False
+        if best == self.dominant or self.levels[best] < self.levels[self.dominant] + self.hysteresis:
+            self._challenger = None
+            return False
+
+        if best != self._challenger:
+            self._challenger = best
+            self._challenge_ticks = 0
+        self._challenge_ticks += 1
+        if self._challenge_ticks < self.hold_ticks:
+            return False
+        self.dominant = best
+        self._challenger = None
+        return True
+
+    def ranking(self, count: int = None) -> List[Hashable]:
+        """
+        participants currently speaking, loudest first
+        """
+        speaking = [key for key, level in self.levels.items() if level > MIN_SPEECH_LEVEL]
+        speaking.sort(key=self.levels.get, reverse=True)
+        return speaking[:count]
@@ -0,0 +1,111 @@
+import struct
+from typing import *
+
+import av
+import numpy as np
+
+from config import RATE, AUDIO_BITRATE, AUDIO_FRAME_MS
+
+# codec name used in the INIT request -> (encoder, decoder, codec sample rate) in libav
+SUPPORTED_CODECS = {
+    'opus': ('libopus', 'libopus', 48000),
+}
+# sample rates a codec can encode at natively, other rates are resampled to the codec sample rate
+NATIVE_RATES = {
+    'opus': (8000, 12000, 16000, 24000, 48000),
+}
+
+
+def pack_packets(packets: List[bytes]) -> bytes:
+    """
+    pack encoded packets into one datagram, each one prefixed with its length
+    :param packets: list of bytes, encoded packets
+    :return: bytes, empty if there is nothing to send
+    """
+    return b''.join(struct.pack("!H", len(packet)) + packet for packet in packets)
+
+
+def unpack_packets(data: bytes) -> List[bytes]:
+    """
+    split a datagram built by pack_packets
+    :param data: bytes
+    :return: list of bytes, encoded packets
+    """
+    packets = []
+    offset = 0
+    while offset + 2 <= len(data):
+        length = struct.unpack_from("!H", data, offset)[0]
+        offset += 2
+        packets.append(data[offset:offset + length])
+        offset += length
+    return packets
+
+
+class AudioEncoder:
+    """
+    Encode 16-bit mono PCM into compressed packets
+    """
+
+    def __init__(self, codec: str = 'opus', bit_rate: int = AUDIO_BITRATE, rate: int = RATE):
+        if codec not in SUPPORTED_CODECS:
+            raise ValueError(f'Unsupported audio codec: {codec}')
+        encoder_name, _, codec_rate = SUPPORTED_CODECS[codec]
+        self.codec = codec
+        self.rate = rate
+        self.context = av.CodecContext.create(encoder_name, 'w')
+        # a 16 kHz mix is encoded as wideband directly instead of being upsampled first
+        self.context.sample_rate = rate if rate in NATIVE_RATES.get(codec, ()) else codec_rate
+        self.context.layout = 'mono'
+        self.context.format = 's16'
+        self.context.bit_rate = bit_rate
+        self.context.options = {
+            'application': 'voip',  # 针对语音优化
+            'frame_duration': str(AUDIO_FRAME_MS)  # 与PCM帧长保持一致
+        }
+        self.pts = 0
+
+    def encode(self, pcm: bytes) -> bytes:
+        """
+        :param pcm: bytes, 16-bit mono PCM at self.rate
+        :return: bytes, packed packets, may be empty while the encoder is buffering
+        """
+        samples = np.frombuffer(pcm, dtype=np.int16).reshape(1, -1)
+        frame = av.AudioFrame.from_ndarray(samples, format='s16', layout='mono')
+        frame.sample_rate = self.rate
+        frame.pts = self.pts
+        self.pts += samples.shape[1]
+        # PyAV resamples to the codec rate and cuts the input into codec sized frames
+        return pack_packets([bytes(packet) for packet in self.context.encode(frame)])
+
+
+class AudioDecoder:
+    """
+    Decode compressed packets back into 16-bit mono PCM
+    """
+
+    def __init__(self, codec: str = 'opus', rate: int = RATE):
+        if codec not in SUPPORTED_CODECS:
+            raise ValueError(f'Unsupported audio codec: {codec}')
+        _, decoder_name, codec_rate = SUPPORTED_CODECS[codec]
+        self.codec = codec
+        self.context = av.CodecContext.create(decoder_name, 'r')
+        self.context.sample_rate = codec_rate
+        self.context.layout = 'mono'
+        self.resampler = av.AudioResampler(format='s16', layout='mono', rate=rate)
+
+    def decode(self, data: bytes) -> bytes:
+        """
+        :param data: bytes, packets packed by AudioEncoder.encode
+        :return: bytes, 16-bit mono PCM at the output rate
+        """
+        pcm = []
+        for payload in unpack_packets(data):
+            try:
+                frames = self.context.decode(av.Packet(payload))
+            except av.AVError as e:
+                print(f"Audio decoding error: {e}")
+                continue
+            for frame in frames:
+                for resampled in self.resampler.resample(frame):
+                    pcm.append(resampled.to_ndarray().tobytes())
+        return b''.join(pcm)
@@ -0,0 +1,144 @@
+"""
+XOR parity forward error correction for audio packets.
+
+Every `group_size` packets the sender emits one parity packet (flag FLAG_FEC) whose sequence number
+is the first sequence number of the group and whose payload is
+
+| count (B) | XOR of the protected units of the group |
+
+where the protected unit of a packet is | capture timestamp (I) | payload length (H) | payload |,
+zero padded to the longest unit of the group. Any single lost packet of a group can be rebuilt
+from the parity and the other packets, without waiting for a retransmission.
+"""
+import struct
+from typing import *
+
+import numpy as np
+
+from DataTransfer.Audio.AudioPacket import AudioPacket, FLAG_FEC
+from config import AUDIO_FEC_GROUP
+
+UNIT_HEADER_FORMAT = "!IH"
+UNIT_HEADER_SIZE = struct.calcsize(UNIT_HEADER_FORMAT)
+
+
+def _protected_unit(timestamp: int, payload: bytes) -> bytes:
+    return struct.pack(UNIT_HEADER_FORMAT, timestamp, len(payload)) + payload
+
+
+def _xor_units(units: List[bytes]) -> bytes:
+    """
+    XOR byte strings of different lengths, the shorter ones are zero padded
+    """
+    width = max(map(len, units))
+    block = np.zeros((len(units), width), dtype=np.uint8)
+    for row, unit in enumerate(units):
+        block[row, :len(unit)] = np.frombuffer(unit, dtype=np.uint8)
+    return np.bitwise_xor.reduce(block, axis=0).tobytes()
+
+
+class FecEncoder:
+    def __init__(self, group_size: int = AUDIO_FEC_GROUP):
+        self.group_size = group_size
+        self._first_sequence = None
+        self._units: List[bytes] = []
+
+    def protect(self, sequence_number: int, timestamp: int, payload: bytes) -> Optional[Tuple[int, bytes]]:
+        """
+        add a sent packet to the current group
+        :return: (first sequence number, parity payload) once the group is complete, otherwise None
+        """
+        if self._first_sequence is None:
+            self._first_sequence = sequence_number
+        self._units.append(_protected_unit(timestamp, payload))
+        if len(self._units) >= self.group_size:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[Tuple[int, bytes]]:
+        """
+        close a partial group, e.g. when transmission stops at the end of a talkspurt
+        :return: (first sequence number, parity payload), None if the group is empty
+        """
+        if not self._units:
+            return None
+        parity = (self._first_sequence, struct.pack("!B", len(self._units)) + _xor_units(self._units))
+        self._first_sequence = None
+        self._units = []
+        return parity
+
+
+class FecDecoder:
+    """
+    Rebuild single lost packets per group for one stream
+    """
+
+    HISTORY = 64  # packets kept to rebuild a lost neighbour
+
+    def __init__(self):
+        self.units: Dict[int, bytes] = {}  # units[sequence_number] = protected unit of a received packet
+        self.parities: Dict[int, AudioPacket] = {}  # parities[first sequence number] = parity still waiting
+        self._newest = None
+        # stats
+        self.parity_received = 0
+        self.recovered = 0
+
+    def _forget_old(self):
+        oldest = self._newest - self.HISTORY
+        for sequence in [sequence for sequence in self.units if sequence < oldest]:
+            del self.units[sequence]
+        for sequence in [sequence for sequence in self.parities if sequence < oldest]:
+            del self.parities[sequence]
+
+    def _try_recover(self, parity: AudioPacket) -> Optional[AudioPacket]:
+        first = parity.sequence_number
+        count = parity.payload[0]
+        missing = [sequence for sequence in range(first, first + count) if sequence not in self.units]
+        if len(missing) > 1:
+            return None  # wait, a late packet may still make the group recoverable
+        del self.parities[first]
+        if not missing:
+            return None
+        units = [parity.payload[1:]] + [self.units[sequence] for sequence in range(first, first + count)
+                                          if sequence != missing[0]]
+        unit = _xor_units(units)
+        timestamp, length = struct.unpack_from(UNIT_HEADER_FORMAT, unit, 0)
+        payload = unit[UNIT_HEADER_SIZE:UNIT_HEADER_SIZE + length]
+        self.units[missing[0]] = unit
+        self.recovered += 1
+        return AudioPacket(parity.payload_type, parity.flags & ~FLAG_FEC, missing[0], timestamp,
+                           parity.participant_id, payload)
+
+    def add_data(self, packet: AudioPacket) -> Optional[AudioPacket]:
+        """
+        :return: AudioPacket rebuilt thanks to this packet, if any
+        """
+        sequence = packet.sequence_number
+        self.units[sequence] = _protected_unit(packet.timestamp, packet.payload)
+        self._newest = sequence if self._newest is None else max(self._newest, sequence)
+        self._forget_old()
+        for first, parity in list(self.parities.items()):
+            if first <= sequence < first + parity.payload[0]:
+                return self._try_recover(parity)
+        return None
+
+    def add_parity(self, packet: AudioPacket) -> Optional[AudioPacket]:
+        """
+        :return: AudioPacket rebuilt from this parity, if any
+        """
+        if not packet.payload:
+            return None
+        self.parity_received += 1
+        self.parities[packet.sequence_number] = packet
+        return self._try_recover(packet)
+
+    def reset(self):
+        self.units.clear()
+        self.parities.clear()
+        self._newest = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'fec_received': self.parity_received,
+            'fec_recovered': self.recovered,
+        }
@@ -0,0 +1,127 @@
+from collections import deque
+from typing import *
+
+import numpy as np
+
+from DataTransfer.Audio.Resampler import PolyphaseResampler
+from config import AUDIO_MIXER_RATE, AUDIO_FRAME_MS, AUDIO_QUEUE_SIZE
+
+INT16_MIN, INT16_MAX = np.iinfo(np.int16).min, np.iinfo(np.int16).max
+
+
+class AudioMixer:
+    """
+    Mix-minus audio mixer.
+
+    Every sender has a small input queue. On each mixing tick one frame is pulled from every
+    non-empty queue and summed once into a single int32 bus, every listener then receives
+    ``bus - own contribution``, clipped to int16 only when it leaves.
+    The cost of a tick is O(senders + listeners) instead of O(senders * listeners).
+
+    The bus runs at a single internal rate, senders and listeners at other rates are
+    resampled on the way in and on the way out.
+    """
+
+    def __init__(self, rate: int = AUDIO_MIXER_RATE, frame_ms: int = AUDIO_FRAME_MS,
+                 queue_size: int = AUDIO_QUEUE_SIZE):
+        self.rate = rate
+        self.frame_size = rate * frame_ms // 1000
+        self.queue_size = queue_size
+        self.listeners: List[Hashable] = []
+        self.output_rates: Dict[Hashable, int] = {}  # output_rates[listener] = rate its mix is sent at
+        self.input_resamplers: Dict[Hashable, PolyphaseResampler] = {}
+        self.output_resamplers: Dict[Hashable, PolyphaseResampler] = {}
+        self.queues: Dict[Hashable, Deque[np.ndarray]] = {}  # queues[sender] = pending int16 frames
+        self.pending: Dict[Hashable, bytearray] = {}  # pending[sender] = PCM not yet forming a whole frame
+        self.active: Set[Hashable] = set()  # senders with queued frames, silent senders cost nothing per tick
+        self.contributions: Dict[Hashable, np.ndarray] = {}  # frames mixed in the last tick
+        self.bus = np.zeros(self.frame_size, dtype=np.int32)
+        self._scratch = np.empty(self.frame_size, dtype=np.int32)
+
+    def add_listener(self, key: Hashable, rate: int = None):
+        """
+        :param key: the listener, also the sender key of its own audio
+        :param rate: int, sampling rate the listener receives the mix at, None for the mixer rate
+        """
+        rate = rate or self.rate
+        self.output_rates[key] = rate
+        if rate != self.rate:
+            self.output_resamplers[key] = PolyphaseResampler(self.rate, rate)
+        else:
+            self.output_resamplers.pop(key, None)
+        if key not in self.listeners:
+            self.listeners.append(key)
+            # the oldest frame is dropped when a sender's clock runs ahead of the mixer
+            self.queues[key] = deque(maxlen=self.queue_size)
+            self.pending[key] = bytearray()
+
+    def remove_listener(self, key: Hashable):
+        if key in self.listeners:
+            self.listeners.remove(key)
+        self.queues.pop(key, None)
+        self.pending.pop(key, None)
+        self.active.discard(key)
+        self.output_rates.pop(key, None)
+        self.input_resamplers.pop(key, None)
+        self.output_resamplers.pop(key, None)
+
+    def push(self, key: Hashable, data: bytes, rate: int = None):
+        """
+        queue 16-bit PCM from a sender for the next mixing ticks
+        :param key: the sender
+        :param data: bytes, raw PCM of any length, it is cut into frames of frame_size samples
+        :param rate: int, sampling rate of data, None for the mixer rate
+        """
+        queue = self.queues.get(key)
+        if queue is None:
+            return
+        rate = rate or self.rate
+        if rate != self.rate:
+            resampler = self.input_resamplers.get(key)
+            if resampler is None or resampler.in_rate != rate:
+                resampler = self.input_resamplers[key] = PolyphaseResampler(rate, self.rate)
+            data = resampler.resample(data)
+        pending = self.pending[key]
+        pending += data
+        frame_bytes = self.frame_size * 2
+        while len(pending) >= frame_bytes:
+            queue.append(np.frombuffer(bytes(pending[:frame_bytes]), dtype=np.int16))
+            del pending[:frame_bytes]
+            self.active.add(key)
+
+    def mix(self) -> Dict[Hashable, bytes]:
+        """
+        pull one frame from every sender and build the mix-minus output of every listener
+        :return: dict, listener -> mixed 16-bit PCM frame at the listener's rate, empty if nobody is sending
+        """
+        contributions: Dict[Hashable, np.ndarray] = {}
+        self.contributions = contributions
+        self.bus.fill(0)
+        for key in list(self.active):
+            queue = self.queues[key]
+            frame = queue.popleft()
+            self.bus += frame
+            contributions[key] = frame
+            if not queue:
+                self.active.discard(key)
+        if not contributions:
+            return {}
+
+        outputs = {}
+        shared = None  # listeners that did not contribute all hear the same full mix
+        for listener in self.listeners:
+            own = contributions.get(listener)
+            if own is None:
+                if shared is None:
+                    np.clip(self.bus, INT16_MIN, INT16_MAX, out=self._scratch)
+                    shared = self._scratch.astype(np.int16).tobytes()
+                outputs[listener] = shared
+            elif len(contributions) > 1:
+                # a lone speaker would only get silence back
+                np.subtract(self.bus, own, out=self._scratch)
+                np.clip(self._scratch, INT16_MIN, INT16_MAX, out=self._scratch)
+                outputs[listener] = self._scratch.astype(np.int16).tobytes()
+        for listener, resampler in self.output_resamplers.items():
+            if listener in outputs:
+                outputs[listener] = resampler.resample(outputs[listener])
+        return outputs
@@ -0,0 +1,80 @@
+"""
+Audio datagram format shared by AudioSender, AudioReceiver and the conference server:
+
+| payload type (B) | flags (B) | sequence number (I) | capture timestamp in ms (I) | id length (B) | participant id | payload |
+"""
+import struct
+import time
+from typing import *
+
+HEADER_FORMAT = "!BBIIB"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# payload types
+PAYLOAD_TYPES = {
+    'pcm': 0,
+    'opus': 1,
+}
+PAYLOAD_CODECS = {value: key for key, value in PAYLOAD_TYPES.items()}
+
+# flags
+FLAG_COMFORT_NOISE = 0x01  # keepalive sent during silence, the payload is the noise level in -dBFS (B)
+FLAG_FEC = 0x02  # XOR parity of a group of packets, see AudioFEC
+
+
+class AudioPacket(NamedTuple):
+    payload_type: int
+    flags: int
+    sequence_number: int
+    timestamp: int
+    participant_id: str
+    payload: bytes
+
+    @property
+    def codec(self) -> str:
+        return PAYLOAD_CODECS.get(self.payload_type, 'pcm')
+
+
+def timestamp_ms() -> int:
+    """
+    capture timestamp in milliseconds, wraps around at 2^32
+    """
+    return int(time.time() * 1000) & 0xFFFFFFFF
+
+
+def wrap_diff(a: int, b: int) -> int:
+    """
+    difference of two 32-bit counters (timestamps, sequence numbers) which may have wrapped around
+    """
+    return ((a - b + (1 << 31)) & 0xFFFFFFFF) - (1 << 31)
+
+
+def pack_audio(participant_id: bytes, sequence_number: int, timestamp: int, payload: bytes,
+               codec: str = 'pcm', flags: int = 0) -> bytes:
+    """
+    :param participant_id: bytes, utf-8 encoded id of the sender (a client uuid or the conference id for a mix)
+    :param sequence_number: int, wraps around at 2^32
+    :param timestamp: int, capture time from timestamp_ms()
+    :param payload: bytes, raw PCM or encoded packets
+    :param codec: str, key of PAYLOAD_TYPES
+    :param flags: int
+    :return: bytes
+    """
+    return struct.pack(HEADER_FORMAT, PAYLOAD_TYPES[codec], flags, sequence_number & 0xFFFFFFFF,
+                       timestamp & 0xFFFFFFFF, len(participant_id)) + participant_id + payload
+
+
+def unpack_audio(data: bytes) -> AudioPacket:
+    """
+    :param data: bytes, a whole datagram
+    :return: AudioPacket
+    :raise ValueError: if the datagram is too short to hold the header
+    """
+    try:
+        payload_type, flags, sequence_number, timestamp, id_len = struct.unpack_from(HEADER_FORMAT, data, 0)
+    except struct.error:
+        raise ValueError(f'Audio packet too short: {len(data)} bytes')
+    offset = HEADER_SIZE
+    participant_id = data[offset:offset + id_len].decode('utf-8', errors='replace')
+    offset += id_len
+    return AudioPacket(payload_type, flags, sequence_number, timestamp, participant_id, data[offset:])
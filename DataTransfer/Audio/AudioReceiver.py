@@ -1,43 +1,135 @@
+import selectors
 import socket
 import threading
-import time
 
 import pyaudio
+
+from DataTransfer.Audio.AudioCodec import AudioDecoder
+from DataTransfer.Audio.AudioFEC import FecDecoder
+from DataTransfer.Audio.AudioPacket import unpack_audio, FLAG_COMFORT_NOISE, FLAG_FEC
+from DataTransfer.Audio.JitterBuffer import JitterBuffer, conceal_frame
 from config import *
 
 
 class AudioReceiver:
     def __init__(self, socket_connection: socket.socket, stream_out: pyaudio.Stream):
         self.stream = stream_out
+        # 每个来源（服务器混音或P2P同伴）一个解码器
+        self.decoders: Dict[str, AudioDecoder] = {}
+        self.jitter_buffer = JitterBuffer()
+        self.fec_decoder = FecDecoder()
+        self._fec_source = None  # participant id of the stream the FEC history belongs to
         self.client_socket = socket_connection
         self.client_socket.setblocking(False)
         self._running = False
         self._thread = None
+        self._play_thread = None
+        # 用于唤醒接收线程的socket对，避免轮询_running
+        self._wakeup_r, self._wakeup_w = None, None
+        self._last_frame = None  # last played PCM, used for packet loss concealment
 
     def _recv_audio(self):
-        while self._running:
+        selector = selectors.DefaultSelector()
+        selector.register(self.client_socket, selectors.EVENT_READ)
+        selector.register(self._wakeup_r, selectors.EVENT_READ)
+        try:
+            while True:
+                for key, _ in selector.select():
+                    if key.fileobj is self._wakeup_r:
+                        return
+                    if not self._drain_socket():
+                        return
+        except (OSError, ValueError):
+            # the socket was closed under us
+            pass
+        finally:
+            selector.close()
+
+    def _drain_socket(self):
+        """
+        read every datagram that is ready
+        :return: bool, False if the socket is closed
+        """
+        while True:
             try:
-                data, _ = self.client_socket.recvfrom(CHUNK * 2)
-                if not data:
-                    break
+                data, _ = self.client_socket.recvfrom(65536)
             except BlockingIOError:
-                time.sleep(0.005)
+                return True
+            except ConnectionResetError:
+                # ICMP port unreachable from a peer that left (Windows), keep receiving
                 continue
             except OSError:
-                break
+                return False
+            if not data:
+                return False
+            try:
+                packet = unpack_audio(data)
+            except ValueError:
+                continue
+            if packet.flags & FLAG_COMFORT_NOISE:
+                continue
+            if packet.participant_id != self._fec_source:
+                self.fec_decoder.reset()
+                self._fec_source = packet.participant_id
+            if packet.flags & FLAG_FEC:
+                recovered = self.fec_decoder.add_parity(packet)
+            else:
+                self.jitter_buffer.put(packet)
+                recovered = self.fec_decoder.add_data(packet)
+            if recovered:
+                # 利用校验包恢复的丢失帧，无需重传
+                self.jitter_buffer.put(recovered)
+
+    def _decode(self, packet):
+        if packet.codec == 'pcm':
+            return packet.payload
+        decoder = self.decoders.get(packet.participant_id)
+        if decoder is None or decoder.codec != packet.codec:
+            decoder = self.decoders[packet.participant_id] = AudioDecoder(packet.codec, AUDIO_OUTPUT_RATE)
+        return decoder.decode(packet.payload)
+
+    def _play_audio(self):
+        while self._running:
+            ready, packet = self.jitter_buffer.get()
+            if not ready:
+                continue
+            if packet is None:
+                # 丢包补偿：重复上一帧并逐渐淡出
+                if self._last_frame is None:
+                    continue
+                data = conceal_frame(self._last_frame, self.jitter_buffer.missing_run)
+            else:
+                data = self._decode(packet)
+                if not data:
+                    continue
+                self._last_frame = data
+            # 阻塞写入，由声卡时钟控制播放节奏
             self.stream.write(data)
 
+    def stats(self):
+        """
+        jitter buffer and FEC statistics: buffer depth, late drops, concealed frames, recovered frames...
+        """
+        return {**self.jitter_buffer.stats(), **self.fec_decoder.stats()}
 
     def start(self):
         if self._running:
-            raise RuntimeError("VideoReceiver is already running")
+            raise RuntimeError("AudioReceiver is already running")
         self._running = True
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
         self._thread = threading.Thread(target=self._recv_audio)
         self._thread.start()
+        self._play_thread = threading.Thread(target=self._play_audio)
+        self._play_thread.start()
 
 
     def terminate(self):
         if not self._running:
             return None
         self._running = False
-        self._thread.join()
\ No newline at end of file
+        self._wakeup_w.send(b'\x00')
+        self.jitter_buffer.close()
+        self._thread.join()
+        self._play_thread.join()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
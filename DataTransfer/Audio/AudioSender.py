@@ -1,11 +1,25 @@
+import struct
 import threading
 import time
+
+from DataTransfer.Audio.AudioCodec import AudioEncoder
+from DataTransfer.Audio.AudioFEC import FecEncoder
+from DataTransfer.Audio.AudioPacket import pack_audio, timestamp_ms, FLAG_COMFORT_NOISE, FLAG_FEC
+from DataTransfer.Audio.VoiceActivityDetector import VoiceActivityDetector
 from config import *
 
 class AudioSender:
-    def __init__(self, socket_connection, client_id=None, stream_in=None):
+    def __init__(self, socket_connection, client_id=None, stream_in=None, codec=AUDIO_CODEC, bit_rate=AUDIO_BITRATE,
+                 fec_group=AUDIO_FEC_GROUP):
         self.client_id = client_id.encode('utf-8') if client_id else b''
         self.stream = stream_in
+        self.codec = codec
+        self.encoder = AudioEncoder(codec, bit_rate) if codec != 'pcm' else None
+        self.sequence_number = 0
+        self.fec = FecEncoder(fec_group) if fec_group > 0 else None
+        self.vad = VoiceActivityDetector()
+        self.transmitting = False  # whether speech is being transmitted (discontinuous transmission)
+        self._last_sent = 0.0
         self.server_socket = socket_connection
         self.sending = False
         self._running = False
@@ -18,13 +32,53 @@ class AudioSender:
         while self._running:
             if self.sending:
                 data = self.stream.read(CHUNK)
-                with self.sock_lock:
-                    self.server_socket.send(data)
+                # 采集完成的时间作为时间戳
+                timestamp = timestamp_ms()
+                if self.vad.is_speech(data):
+                    self.transmitting = True
+                    self._send_speech(data, timestamp)
+                    continue
             else:
-                data = b'\x00' * CHUNK * 2
-                with self.sock_lock:
-                    self.server_socket.send(data)
                 time.sleep(1 / RATE * CHUNK)
+            if self.transmitting:
+                # 说话结束，补发未满一组的校验包
+                self.transmitting = False
+                self._send_parity(self.fec.flush() if self.fec else None)
+            # 不说话时不发送音频，只偶尔发送舒适噪声包保持连接
+            if time.time() - self._last_sent >= AUDIO_KEEPALIVE_INTERVAL:
+                self._send_comfort_noise()
+
+    def _send_speech(self, data, timestamp):
+        if self.encoder:
+            data = self.encoder.encode(data)
+            if not data:
+                return
+        packet = pack_audio(self.client_id, self.sequence_number, timestamp, data, self.codec)
+        if self.fec:
+            parity = self.fec.protect(self.sequence_number, timestamp, data)
+        else:
+            parity = None
+        self.sequence_number += 1
+        self._send(packet)
+        self._send_parity(parity)
+
+    def _send_parity(self, parity):
+        if parity is None:
+            return
+        first_sequence, payload = parity
+        self._send(pack_audio(self.client_id, first_sequence, timestamp_ms(), payload, self.codec, FLAG_FEC))
+
+    def _send_comfort_noise(self):
+        noise_level = min(max(int(-self.vad.noise_floor), 0), 255) if self.sending else 255
+        # 舒适噪声包不占用序列号，接收端和混音器都会跳过它
+        packet = pack_audio(self.client_id, self.sequence_number, timestamp_ms(), struct.pack("!B", noise_level),
+                            self.codec, FLAG_COMFORT_NOISE)
+        self._send(packet)
+
+    def _send(self, packet):
+        with self.sock_lock:
+            self.server_socket.send(packet)
+        self._last_sent = time.time()
 
     def start(self):
         if self._running:
@@ -0,0 +1,151 @@
+import math
+import threading
+from typing import *
+
+import numpy as np
+
+from DataTransfer.Audio.AudioPacket import AudioPacket, timestamp_ms, wrap_diff
+from config import AUDIO_FRAME_MS, AUDIO_JITTER_MIN_DELAY, AUDIO_JITTER_MAX_DELAY, AUDIO_MAX_CONCEAL
+
+
+def conceal_frame(last_frame: bytes, missing_run: int) -> bytes:
+    """
+    packet loss concealment: repeat the last played frame, fading out with every further missing frame
+    :param last_frame: bytes, 16-bit PCM of the last played frame
+    :param missing_run: int, number of consecutive missing frames including this one
+    :return: bytes, 16-bit PCM
+    """
+    samples = np.frombuffer(last_frame, dtype=np.int16)
+    return (samples * (0.5 ** missing_run)).astype(np.int16).tobytes()
+
+
+class JitterBuffer:
+    """
+    Adaptive jitter buffer for one audio stream.
+
+    Packets are reordered by sequence number and released one per frame period once the buffer
+    holds `target_frames` frames. The target follows the RFC 3550 inter-arrival jitter estimate and
+    is re-evaluated when playout restarts after an underrun (e.g. at the start of a talkspurt).
+    """
+
+    def __init__(self, frame_ms: int = AUDIO_FRAME_MS, min_delay: int = AUDIO_JITTER_MIN_DELAY,
+                 max_delay: int = AUDIO_JITTER_MAX_DELAY):
+        self.frame_ms = frame_ms
+        self.min_frames = max(1, min_delay // frame_ms)
+        self.max_frames = max(self.min_frames, max_delay // frame_ms)
+        self.target_frames = self.min_frames
+        self.frames: Dict[int, AudioPacket] = {}  # frames[sequence_number] = packet
+        self.source: Optional[str] = None  # participant id of the stream being played
+        self.next_sequence: Optional[int] = None
+        self.playing = False
+        self.closed = False
+        self.missing_run = 0  # consecutive frames concealed
+        self.jitter = 0.0  # inter-arrival jitter in ms
+        self._last_transit = None
+        self._cond = threading.Condition()
+        # stats
+        self.received = 0
+        self.late_drops = 0
+        self.overflow_drops = 0
+        self.concealed = 0
+
+    def _reset(self, source: str):
+        self.frames.clear()
+        self.source = source
+        self.next_sequence = None
+        self.playing = False
+        self.missing_run = 0
+        self._last_transit = None
+
+    def _update_jitter(self, arrival: int, timestamp: int):
+        transit = wrap_diff(arrival, timestamp)
+        if self._last_transit is not None:
+            self.jitter += (abs(transit - self._last_transit) - self.jitter) / 16
+        self._last_transit = transit
+
+    def _adapted_target(self) -> int:
+        frames = math.ceil(4 * self.jitter / self.frame_ms) + 1
+        return min(max(frames, self.min_frames), self.max_frames)
+
+    def put(self, packet: AudioPacket):
+        arrival = timestamp_ms()
+        with self._cond:
+            if packet.participant_id != self.source:
+                # the stream changed (e.g. switching between server mix and P2P peer)
+                self._reset(packet.participant_id)
+            self.received += 1
+            self._update_jitter(arrival, packet.timestamp)
+            sequence = packet.sequence_number
+            if sequence in self.frames:
+                return  # duplicate
+            if self.playing and sequence < self.next_sequence:
+                # too late to be played, and a sign the playout delay is too short
+                self.late_drops += 1
+                self.target_frames = min(self.target_frames + 1, self.max_frames)
+                return
+            self.frames[sequence] = packet
+            limit = self.target_frames + 2 if self.playing else self.max_frames
+            while len(self.frames) > limit:
+                # latency piles up, drop the oldest frame
+                oldest = min(self.frames)
+                del self.frames[oldest]
+                self.next_sequence = oldest + 1
+                self.overflow_drops += 1
+            self._cond.notify()
+
+    def get(self, timeout: float = None) -> Tuple[bool, Optional[AudioPacket]]:
+        """
+        take the frame to be played next
+        :param timeout: float, seconds to wait while buffering, None to wait until enough frames or close()
+        :return: (False, None) while buffering or once closed, (True, None) if the frame is missing and
+                 must be concealed, otherwise (True, packet)
+        """
+        with self._cond:
+            if self.closed:
+                return False, None
+            if not self.playing:
+                self._cond.wait_for(lambda: self.closed or len(self.frames) >= self.target_frames, timeout)
+                if self.closed or len(self.frames) < self.target_frames:
+                    return False, None
+                self.playing = True
+                self.next_sequence = min(self.frames)
+
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            packet = self.frames.pop(sequence, None)
+            if packet is not None:
+                self.missing_run = 0
+                return True, packet
+
+            self.missing_run += 1
+            if not self.frames and self.missing_run > AUDIO_MAX_CONCEAL:
+                # the stream has stopped, rebuffer with a delay fitted to the current jitter. The sender's
+                # sequence numbers stood still meanwhile (mute, DTX), so playout restarts from the next packet
+                self.playing = False
+                self.next_sequence = None
+                self.missing_run = 0
+                self.target_frames = self._adapted_target()
+                return False, None
+            self.concealed += 1
+            return True, None
+
+    def close(self):
+        """
+        drop all frames and wake up the reader blocked in get()
+        """
+        with self._cond:
+            self._reset(None)
+            self.closed = True
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'depth': len(self.frames),
+                'target_delay_ms': self.target_frames * self.frame_ms,
+                'jitter_ms': round(self.jitter, 2),
+                'received': self.received,
+                'late_drops': self.late_drops,
+                'overflow_drops': self.overflow_drops,
+                'concealed': self.concealed,
+            }
@@ -0,0 +1,65 @@
+from typing import *
+
+from DataTransfer.Audio.AudioPacket import AudioPacket, wrap_diff
+
+
+class ReorderBuffer:
+    """
+    Put the packets of one stream back in sequence order for the server mixer, which plays what it
+    is given.
+
+    Packets after a gap are held until the gap is filled, by a late packet or by one rebuilt from
+    FEC parity, which only arrives after the rest of its group. Once more than `window` packets wait
+    the gap is given up. With a window of 0 gaps are never waited for and late packets are dropped.
+    """
+
+    RESTART = 64  # a packet this far behind means the sender started counting again
+
+    def __init__(self, window: int = 0):
+        """
+        :param window: int, packets held behind a gap, the FEC group size of the stream
+        """
+        self.window = window
+        self.next_sequence: Optional[int] = None
+        self.held: Dict[int, AudioPacket] = {}  # held[sequence_number] = packet waiting behind a gap
+        # stats
+        self.late_drops = 0
+        self.lost = 0
+
+    def push(self, packet: AudioPacket) -> List[AudioPacket]:
+        """
+        :param packet: AudioPacket, received or rebuilt
+        :return: list of AudioPacket, the packets now in order, oldest first
+        """
+        sequence = packet.sequence_number
+        if self.next_sequence is not None:
+            behind = wrap_diff(self.next_sequence, sequence)
+            if behind > self.RESTART:
+                self.clear()
+            elif behind > 0 or sequence in self.held:
+                self.late_drops += 1
+                return []
+        if self.next_sequence is None:
+            self.next_sequence = sequence
+        self.held[sequence] = packet
+        ready = []
+        while self.held:
+            packet = self.held.pop(self.next_sequence, None)
+            if packet is None:
+                if len(self.held) <= self.window:
+                    break
+                # 等不到丢失的包了, 从下一个收到的包继续
+                oldest = min(self.held, key=lambda held: wrap_diff(held, self.next_sequence))
+                self.lost += wrap_diff(oldest, self.next_sequence)
+                self.next_sequence = oldest
+                continue
+            ready.append(packet)
+            self.next_sequence = (self.next_sequence + 1) & 0xFFFFFFFF
+        return ready
+
+    def clear(self):
+        """
+        drop the held packets and start over with the next packet, e.g. once the sender is silent
+        """
+        self.held.clear()
+        self.next_sequence = None
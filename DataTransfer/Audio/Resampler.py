@@ -0,0 +1,71 @@
+import math
+from typing import *
+
+import numpy as np
+
+INT16_MIN, INT16_MAX = np.iinfo(np.int16).min, np.iinfo(np.int16).max
+
+
+def design_filter(up: int, down: int, zero_crossings: int = 8, beta: float = 8.0) -> np.ndarray:
+    """
+    windowed sinc low-pass filter for resampling by up/down, designed at the upsampled rate
+    :param up: int, interpolation factor L
+    :param down: int, decimation factor M
+    :param zero_crossings: int, zero crossings of the sinc kept on each side
+    :param beta: float, Kaiser window parameter
+    :return: np.ndarray, float64 taps with a passband gain of `up`
+    """
+    factor = max(up, down)
+    cutoff = 0.5 / factor * 0.95  # cycles per upsampled sample, a little below Nyquist of the lower rate
+    length = 2 * zero_crossings * factor + 1
+    n = np.arange(length) - (length - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, beta)
+    return taps * (up / taps.sum())
+
+
+class PolyphaseResampler:
+    """
+    Streaming rational resampler for 16-bit mono PCM.
+
+    The filter is split into `up` phases of `taps` coefficients, so the zero stuffed upsampled signal
+    is never built: output sample n at upsampled time t = n * down is
+    ``sum_k x[t // up - k] * h[t % up + k * up]``, computed for a whole chunk at once.
+    The last input samples and the position of the next output are kept between calls,
+    so consecutive chunks join without clicks whatever their length.
+    """
+
+    def __init__(self, in_rate: int, out_rate: int):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        common = math.gcd(in_rate, out_rate)
+        self.up = out_rate // common
+        self.down = in_rate // common
+        taps = design_filter(self.up, self.down)
+        self.taps = math.ceil(len(taps) / self.up)
+        taps = np.pad(taps, (0, self.taps * self.up - len(taps)))
+        # bank[phase, k] = h[phase + k * up]
+        self.bank = taps.reshape(self.taps, self.up).T.astype(np.float32)
+        self.history = np.zeros(self.taps - 1, dtype=np.float32)
+        self._time = 0  # upsampled time of the next output, relative to the start of the next chunk
+        self._offsets = np.arange(self.taps - 1, -1, -1)
+
+    def resample(self, data: bytes) -> bytes:
+        """
+        :param data: bytes, 16-bit PCM at in_rate
+        :return: bytes, 16-bit PCM at out_rate, about len(data) * out_rate / in_rate long
+        """
+        if self.up == self.down:
+            return data
+        samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+        end = len(samples) * self.up
+        times = np.arange(self._time, end, self.down)
+        buffer = np.concatenate((self.history, samples))
+        self.history = buffer[len(buffer) - len(self.history):]
+        if not len(times):
+            self._time -= end
+            return b''
+        self._time = int(times[-1]) + self.down - end
+        # windows[n, k] = x[t_n // up - k]
+        windows = buffer[(times // self.up)[:, None] + self._offsets[None, :]]
+        out = np.einsum('nk,nk->n', windows, self.bank[times % self.up])
+        return np.clip(np.rint(out), INT16_MIN, INT16_MAX).astype(np.int16).tobytes()
@@ -0,0 +1,52 @@
+import numpy as np
+
+from config import AUDIO_FRAME_MS, AUDIO_VAD_THRESHOLD, AUDIO_VAD_HANGOVER
+
+MIN_SPEECH_LEVEL = -55.0  # dBFS, anything quieter is never speech
+
+
+def frame_level(pcm: bytes) -> float:
+    """
+    RMS level of a frame
+    :param pcm: bytes, 16-bit PCM
+    :return: float, level in dBFS, -96 for digital silence
+    """
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+    if samples.size == 0:
+        return -96.0
+    rms = np.sqrt(np.mean(samples * samples)) / 32768.0
+    return max(20 * np.log10(rms), -96.0) if rms > 0 else -96.0
+
+
+class VoiceActivityDetector:
+    """
+    Energy based voice activity detector.
+
+    A frame is speech when its level is `threshold` dB above the tracked noise floor.
+    The floor follows quiet frames quickly and loud frames slowly, so steady background
+    noise is learnt while speech is not. Speech is held for `hangover` ms so word endings
+    and short pauses are not cut off.
+    """
+
+    def __init__(self, threshold: float = AUDIO_VAD_THRESHOLD, hangover: int = AUDIO_VAD_HANGOVER,
+                 frame_ms: int = AUDIO_FRAME_MS):
+        self.threshold = threshold
+        self.hangover_frames = max(1, hangover // frame_ms)
+        self.noise_floor = -60.0
+        self.level = -96.0  # level of the last frame
+        self._hangover = 0
+
+    def is_speech(self, pcm: bytes) -> bool:
+        self.level = frame_level(pcm)
+        if self.level < self.noise_floor:
+            self.noise_floor += 0.5 * (self.level - self.noise_floor)
+        else:
+            self.noise_floor += 0.005 * (self.level - self.noise_floor)
+
+        if self.level > max(self.noise_floor + self.threshold, MIN_SPEECH_LEVEL):
+            self._hangover = self.hangover_frames
+            return True
+        if self._hangover > 0:
+            self._hangover -= 1
+            return True
+        return False
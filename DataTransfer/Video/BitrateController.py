@@ -0,0 +1,52 @@
+import time
+from typing import *
+
+from config import VIDEO_LOSS_LOW, VIDEO_LOSS_HIGH, VIDEO_REPORT_INTERVAL
+
+
+class BitrateController:
+    """
+    Loss-based AIMD congestion controller, in the spirit of the loss-based half of GCC.
+
+    Loss above `VIDEO_LOSS_HIGH` cuts the rate in proportion to the loss, loss below
+    `VIDEO_LOSS_LOW` raises it by a fixed fraction of the maximum rate, anything in between
+    holds it. Each direction moves at most once per report interval, so reports of several
+    receivers about the same congestion do not stack.
+    """
+
+    INCREASE = 0.05  # additive step as a fraction of max_bitrate
+
+    def __init__(self, min_bitrate: int, max_bitrate: int, initial: int = None):
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.bitrate = initial or max_bitrate
+        self._last_decrease = 0.0
+        self._last_increase = 0.0
+
+    def update(self, loss: float, received_bitrate: float = None) -> int:
+        """
+        feed one receiver report
+        :param loss: float, fraction of chunks lost since the previous report
+        :param received_bitrate: float, bit/s the receiver actually got, bounds a cut
+        :return: int, the new target bit rate
+        """
+        now = time.time()
+        if loss > VIDEO_LOSS_HIGH:
+            if now - self._last_decrease >= VIDEO_REPORT_INTERVAL:
+                self._last_decrease = now
+                bitrate = self.bitrate * (1 - 0.5 * loss)
+                if received_bitrate:
+                    bitrate = min(bitrate, received_bitrate)
+                self.bitrate = bitrate
+        elif loss < VIDEO_LOSS_LOW and now - max(self._last_increase, self._last_decrease) >= VIDEO_REPORT_INTERVAL:
+            self._last_increase = now
+            self.bitrate += self.INCREASE * self.max_bitrate
+        self.bitrate = int(min(max(self.bitrate, self.min_bitrate), self.max_bitrate))
+        return self.bitrate
+
+    @property
+    def scale(self) -> float:
+        """
+        target as a fraction of the maximum rate
+        """
+        return self.bitrate / self.max_bitrate
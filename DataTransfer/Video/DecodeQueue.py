@@ -0,0 +1,57 @@
+from collections import deque
+from typing import *
+
+
+class DecodeQueue:
+    """
+    Encoded frames of one stream waiting for a decode worker.
+
+    One pool task at a time drains a queue (`busy`), so the frames of a stream are decoded in
+    order while different streams decode in parallel. Every frame of our H.264 streams is a
+    reference frame, so a worker that falls behind cannot skip single frames: an overflow drops
+    everything older than the newest keyframe queued, and if there is none the whole queue is
+    dropped and the stream waits for the next keyframe.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.frames: Deque[Tuple[bytes, bool]] = deque()
+        self.busy = False  # a worker is draining the queue
+        self.waiting = False  # frames were lost, only a keyframe can be decoded next
+        self.dropped = 0  # frames dropped to catch up
+
+    def push(self, data: bytes, keyframe: bool) -> bool:
+        """
+        :param data: bytes, an encoded frame
+        :param keyframe: bool
+        :return: bool, True if the stream needs a keyframe to go on
+        """
+        if self.waiting and not keyframe:
+            self.dropped += 1
+            return True
+        self.waiting = False
+        self.frames.append((data, keyframe))
+        if len(self.frames) <= self.size:
+            return False
+        keyframes = [index for index, (_, is_keyframe) in enumerate(self.frames) if is_keyframe]
+        if keyframes and len(self.frames) - keyframes[-1] <= self.size:
+            # 从最新的关键帧继续解码
+            for _ in range(keyframes[-1]):
+                self.frames.popleft()
+            self.dropped += keyframes[-1]
+            return False
+        self.dropped += len(self.frames)
+        self.frames.clear()
+        self.waiting = True
+        return True
+
+    def pop(self) -> Optional[bytes]:
+        return self.frames.popleft()[0] if self.frames else None
+
+    def fail(self):
+        """
+        the decoder failed, drop what is queued and wait for a keyframe
+        """
+        self.dropped += len(self.frames)
+        self.frames.clear()
+        self.waiting = True
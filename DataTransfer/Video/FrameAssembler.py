@@ -0,0 +1,224 @@
+import heapq
+import itertools
+from typing import *
+
+from DataTransfer.Video.Packetizer import decodable_runs
+from DataTransfer.Video.VideoFEC import recover
+from DataTransfer.Video.VideoPacket import VideoPacket, wrap_diff
+from config import VIDEO_FRAME_DEADLINE, VIDEO_NACK_INTERVAL, VIDEO_NACK_RETRIES, VIDEO_CHUNK_SIZE
+
+
+class _Frame:
+    def __init__(self, packet: VideoPacket, deadline: float):
+        self.data_len = packet.data_len
+        self.num_chunks = packet.num_chunks
+        self.num_parity = packet.num_parity
+        self.keyframe = packet.is_keyframe
+        # 整帧预先分配，数据块按偏移直接写入，不再拼接
+        self.buffer = bytearray(packet.data_len)
+        self.view = memoryview(self.buffer)
+        self.spans: Dict[int, Tuple[int, int]] = {}  # spans[index] = (offset, length) of a data chunk in buffer
+        self.parities: Dict[int, bytes] = {}  # parities[group] = parity chunk
+        self.flags: Dict[int, int] = {}  # NAL boundary flags of the data chunks received
+        self.highest = -1  # highest data chunk index received
+        self.deadline = deadline
+        self.nacked_at = float('-inf')
+        self.nacks = 0
+
+    @property
+    def complete(self) -> bool:
+        return len(self.spans) >= self.num_chunks
+
+    def data(self) -> bytearray:
+        return self.buffer
+
+    def chunks(self) -> Dict[int, Tuple[int, memoryview]]:
+        """
+        (offset, payload) of the data chunks received, the payloads are views into the frame buffer
+        """
+        return {index: (offset, self.view[offset:offset + length]) for index, (offset, length) in self.spans.items()}
+
+    def partial_data(self) -> bytes:
+        """
+        the complete NAL units (slices) of an incomplete frame, chunks rebuilt from parity carry no
+        flags and only continue a NAL unit
+        """
+        chunks = {index: chunk for index, (_, chunk) in self.chunks().items()}
+        return decodable_runs(chunks, self.flags, self.num_chunks)
+
+    def _place(self, index: int, offset: int, payload: bytes) -> bool:
+        end = offset + len(payload)
+        if index >= self.num_chunks or end > self.data_len:
+            return False
+        self.view[offset:end] = payload
+        self.spans[index] = (offset, len(payload))
+        return True
+
+    def add(self, packet: VideoPacket) -> int:
+        """
+        :return: int, number of data chunks rebuilt from parity
+        """
+        if packet.is_parity:
+            self.parities[packet.sequence_number - self.num_chunks] = packet.payload
+        elif packet.sequence_number not in self.spans:
+            if not self._place(packet.sequence_number, packet.offset, packet.payload):
+                return 0
+            self.flags[packet.sequence_number] = packet.flags
+            self.highest = max(self.highest, packet.sequence_number)
+        if not self.parities or self.complete:
+            return 0
+        rebuilt = recover(self.chunks(), self.parities, self.num_chunks, self.num_parity)
+        return sum(self._place(index, offset, payload) for index, (offset, payload) in rebuilt.items())
+
+
+class _Stream:
+    def __init__(self, layer: int):
+        self.layer = layer
+        self.next_frame: Optional[int] = None  # frame id to decode next, None while waiting for a keyframe
+        self.newest: Optional[int] = None  # newest frame id seen
+        self.frames: Dict[int, _Frame] = {}
+
+
+class FrameAssembler:
+    """
+    Rebuild encoded frames from video chunks, several frames of a stream may be in flight at once.
+
+    Frames are released strictly in frame id order starting from a keyframe, a frame still
+    missing chunks holds the newer ones back until it completes (after a retransmission)
+    or its deadline passes. The complete slices of a frame given up are still handed to the
+    decoder, which conceals the rest, then the stream waits for the next keyframe.
+
+    Every frame is written in place into a buffer of its announced length, and the deadlines
+    sit in a heap, so a packet costs no scan over the frames in flight.
+    """
+
+    def __init__(self, deadline: float = VIDEO_FRAME_DEADLINE):
+        self.deadline = deadline
+        self.streams: Dict[str, _Stream] = {}
+        self.recovered = 0  # data chunks rebuilt from parity
+        # (deadline, tie breaker, client id, frame id, frame), entries of frames already gone are skipped
+        self._deadlines: List[Tuple[float, int, str, int, _Frame]] = []
+        self._counter = itertools.count()
+
+    @property
+    def next_deadline(self) -> Optional[float]:
+        """
+        earliest deadline of a frame in flight, None if there is none
+        """
+        return self._deadlines[0][0] if self._deadlines else None
+
+    def waiting(self, client_id: str) -> bool:
+        """
+        :return: bool, True if the stream can only go on from a keyframe
+        """
+        stream = self.streams.get(client_id)
+        return stream is None or stream.next_frame is None
+
+    def reset(self, client_id: str):
+        """
+        drop the frames in flight and wait for a keyframe, e.g. after a decoding error
+        """
+        stream = self.streams.get(client_id)
+        if stream:
+            stream.frames.clear()
+            stream.next_frame = None
+
+    def remove(self, client_id: str):
+        self.streams.pop(client_id, None)
+
+    def clear(self):
+        self.streams.clear()
+        self._deadlines.clear()
+
+    def add(self, packet: VideoPacket, now: float) -> List[Tuple[bytearray, bool]]:
+        """
+        :return: list of (encoded frame, is keyframe), complete frames of the packet's stream ready to be
+            decoded, in order
+        """
+        stream = self.streams.get(packet.participant_id)
+        if stream is None or stream.layer != packet.layer:
+            if stream is not None and not packet.is_keyframe:
+                return []  # a layer switch only starts at a keyframe
+            stream = self.streams[packet.participant_id] = _Stream(packet.layer)
+        frame_id = packet.frame_id
+        if stream.next_frame is not None and wrap_diff(frame_id, stream.next_frame) < 0:
+            return []  # late chunk of a frame already released or given up
+        if stream.newest is None or wrap_diff(frame_id, stream.newest) > 0:
+            stream.newest = frame_id
+        frame = stream.frames.get(frame_id)
+        if frame is None:
+            if packet.data_len > packet.num_chunks * VIDEO_CHUNK_SIZE:
+                return []  # not a frame we could have sent, do not allocate for it
+            frame = stream.frames[frame_id] = _Frame(packet, now + self.deadline)
+            heapq.heappush(self._deadlines, (frame.deadline, next(self._counter), packet.participant_id, frame_id, frame))
+        elif packet.data_len != frame.data_len or packet.num_chunks != frame.num_chunks:
+            return []
+        self.recovered += frame.add(packet)
+        return self._release(stream)
+
+    def _release(self, stream: _Stream) -> List[Tuple[bytearray, bool]]:
+        ready = []
+        # a complete keyframe newer than the frame we wait for makes the older frames useless
+        keyframes = [frame_id for frame_id, frame in stream.frames.items() if frame.keyframe and frame.complete
+                     and (stream.next_frame is None or wrap_diff(frame_id, stream.next_frame) > 0)]
+        if keyframes:
+            start = max(keyframes, key=lambda frame_id: wrap_diff(frame_id, stream.newest))
+            for frame_id in [frame_id for frame_id in stream.frames if wrap_diff(frame_id, start) < 0]:
+                del stream.frames[frame_id]
+            stream.next_frame = start
+        if stream.next_frame is None:
+            return ready
+        while True:
+            frame = stream.frames.get(stream.next_frame)
+            if frame is None or not frame.complete:
+                return ready
+            ready.append((frame.data(), frame.keyframe))
+            del stream.frames[stream.next_frame]
+            stream.next_frame = (stream.next_frame + 1) & 0xFFFFFFFF
+
+    def missing(self, client_id: str, now: float) -> List[Tuple[int, int, List[int]]]:
+        """
+        chunks to ask again for (NACK): the gaps below the highest data chunk of a frame, and every
+        missing data chunk of a frame older than the newest one, parity left to rebuild them first. Every frame is asked for at most
+        VIDEO_NACK_RETRIES times, VIDEO_NACK_INTERVAL apart.
+        :return: list of (layer, frame id, chunk indexes)
+        """
+        stream = self.streams.get(client_id)
+        if stream is None:
+            return []
+        requests = []
+        for frame_id, frame in stream.frames.items():
+            if frame.complete or frame.nacks >= VIDEO_NACK_RETRIES or now - frame.nacked_at < VIDEO_NACK_INTERVAL:
+                continue
+            end = frame.num_chunks if frame_id != stream.newest else frame.highest
+            sequences = [index for index in range(end) if index not in frame.spans]
+            if sequences:
+                frame.nacks += 1
+                frame.nacked_at = now
+                requests.append((stream.layer, frame_id, sequences))
+        return requests
+
+    def expire(self, now: float) -> List[Tuple[str, bytes]]:
+        """
+        give up frames past their deadline
+        :return: list of (client id, complete slices of the frame it was waiting for, may be empty)
+            of the streams that lost a frame and now wait for a keyframe
+        """
+        due: Dict[str, List[int]] = {}
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, _, client_id, frame_id, frame = heapq.heappop(self._deadlines)
+            stream = self.streams.get(client_id)
+            if stream is not None and stream.frames.get(frame_id) is frame:
+                due.setdefault(client_id, []).append(frame_id)
+        broken = []
+        for client_id, expired in due.items():
+            stream = self.streams[client_id]
+            partial = b''
+            if stream.next_frame in expired:
+                partial = stream.frames[stream.next_frame].partial_data()
+            for frame_id in expired:
+                del stream.frames[frame_id]
+            if stream.next_frame is not None:
+                stream.next_frame = None
+                broken.append((client_id, partial))
+        return broken
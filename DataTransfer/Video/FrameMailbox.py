@@ -0,0 +1,60 @@
+import threading
+from typing import *
+
+
+class FrameMailbox:
+    """
+    Latest-wins hand-over of video frames from the receiving threads to the GUI thread.
+
+    Only the newest frame is kept: a frame posted before the GUI took the previous one replaces it
+    and counts as dropped. The GUI is notified once per frame it can take, so at most one update is
+    ever queued in its event loop however busy it is.
+
+    A frame is in use from post() until it is replaced unseen, or until the GUI takes the next one,
+    then it is passed to `release` so its buffer can be drawn into again.
+    """
+
+    EMPTY = object()  # take() result when no new frame was posted
+
+    def __init__(self, notify: Callable[[], None], release: Callable[[Any], None] = None):
+        """
+        :param notify: called from the posting thread when a frame is waiting, e.g. a pyqtSignal's emit
+        :param release: called with a frame no longer in use, e.g. Letterbox.release, None to let them go
+        """
+        self.notify = notify
+        self.release = release
+        self.dropped = 0  # frames replaced before they were shown
+        self._frame = self.EMPTY
+        self._taken = None  # frame the GUI shows
+        self._lock = threading.Lock()
+
+    def _release(self, frame: Any):
+        if frame is not None and frame is not self.EMPTY and self.release is not None:
+            self.release(frame)
+
+    def post(self, frame: Any):
+        """
+        :param frame: the newest frame, None if there is no video to show
+        """
+        with self._lock:
+            replaced, self._frame = self._frame, frame
+            pending = replaced is not self.EMPTY
+            if pending:
+                self.dropped += 1
+        if pending:
+            self._release(replaced)
+        else:
+            self.notify()
+
+    def take(self) -> Any:
+        """
+        called from the GUI thread, the frame taken before is released: the GUI must show the new one instead
+        :return: the newest frame, EMPTY if it was already taken
+        """
+        with self._lock:
+            frame, self._frame = self._frame, self.EMPTY
+            if frame is self.EMPTY:
+                return frame
+            previous, self._taken = self._taken, frame
+        self._release(previous)
+        return frame
@@ -0,0 +1,86 @@
+from typing import *
+
+from DataTransfer.Video.VideoPacket import VideoPacket
+from config import VIDEO_SIMULCAST_LAYERS, VIDEO_DOWNLINK_BANDWIDTH, VIDEO_SPEAKER_SHARE, camera_width, camera_height
+
+
+class LayerSelector:
+    """
+    Choose which simulcast layer of every sender is forwarded to every receiver.
+
+    A receiver gets the smallest layer covering its tile, stepped down until the layers of
+    all the streams it receives fit in the bandwidth it reported, where the active speakers get
+    `speaker_share` shares of the bandwidth and the other streams one. A receiver only moves to
+    a new layer at the start of a keyframe of that layer, so its decoder never sees a
+    P-frame referring to a picture of another resolution.
+    """
+
+    def __init__(self, layers: List[Tuple[int, int, int]] = None, speaker_share: int = VIDEO_SPEAKER_SHARE):
+        self.layers = layers or VIDEO_SIMULCAST_LAYERS
+        self.speaker_share = speaker_share
+        self.speakers: Set[Hashable] = set()  # senders whose streams are preferred
+        self.reports: Dict[Hashable, Tuple[int, int, int]] = {}  # reports[receiver] = (tile w, tile h, bandwidth)
+        self.top_layers: Dict[Hashable, int] = {}  # top_layers[sender] = highest layer it sends
+        self.current: Dict[Tuple[Hashable, Hashable], int] = {}  # current[sender, receiver] = layer forwarded
+        self.targets: Dict[Tuple[Hashable, Hashable], int] = {}  # targets[sender, receiver] = layer to switch to
+
+    def update_report(self, receiver: Hashable, tile_width: int, tile_height: int,
+                      bandwidth: int = VIDEO_DOWNLINK_BANDWIDTH):
+        self.reports[receiver] = (tile_width, tile_height, bandwidth)
+
+    def set_speakers(self, senders: Iterable[Hashable]):
+        """
+        :param senders: the senders of the active speakers, their streams get a larger share of every downlink
+        """
+        self.speakers = set(senders)
+
+    def remove(self, key: Hashable):
+        self.speakers.discard(key)
+        self.reports.pop(key, None)
+        self.top_layers.pop(key, None)
+        for pair in [pair for pair in self.current if key in pair]:
+            del self.current[pair]
+        for pair in [pair for pair in self.targets if key in pair]:
+            del self.targets[pair]
+
+    def target_layer(self, sender: Hashable, receiver: Hashable) -> int:
+        """
+        layer of `sender` that fits the tile and the share of bandwidth `receiver` reported
+        """
+        top = min(self.top_layers.get(sender, 0), len(self.layers) - 1)
+        tile_width, tile_height, bandwidth = self.reports.get(
+            receiver, (camera_width, camera_height, VIDEO_DOWNLINK_BANDWIDTH))
+        layer = top
+        for index, (width, height, _) in enumerate(self.layers[:top + 1]):
+            if width >= tile_width and height >= tile_height:
+                layer = index
+                break
+        # the receiver does not get its own stream
+        shares = sum(self.speaker_share if key in self.speakers else 1 for key in self.top_layers if key != receiver)
+        budget = bandwidth * (self.speaker_share if sender in self.speakers else 1) / max(1, shares)
+        while layer > 0 and self.layers[layer][2] > budget:
+            layer -= 1
+        return layer
+
+    def forward(self, sender: Hashable, receiver: Hashable, packet: VideoPacket) -> bool:
+        """
+        :return: bool, True if the chunk has to be forwarded to the receiver
+        """
+        if packet.layer > self.top_layers.get(sender, -1):
+            self.top_layers[sender] = packet.layer
+        current = self.current.get((sender, receiver))
+        if packet.sequence_number == 0:
+            # re-evaluated once per frame
+            target = self.targets[sender, receiver] = self.target_layer(sender, receiver)
+            if packet.layer != current and packet.is_keyframe and packet.layer == target:
+                self.current[sender, receiver] = current = packet.layer
+        return packet.layer == current
+
+    def wants_keyframe(self, sender: Hashable, receiver: Hashable) -> Optional[int]:
+        """
+        :return: int, the layer a keyframe is needed from to switch the receiver, None if no switch is pending
+        """
+        target = self.targets.get((sender, receiver))
+        if target is not None and target != self.current.get((sender, receiver)):
+            return target
+        return None
@@ -0,0 +1,83 @@
+import threading
+from typing import *
+
+import cv2
+import numpy as np
+
+from config import view_width, view_height
+
+
+class Letterbox:
+    """
+    Scale RGB grid frames to the display size off the GUI thread.
+
+    The output is in the memory layout of QImage.Format_RGB32 (B, G, R, 255 per pixel), with black
+    bars where the aspect ratios differ, so the GUI wraps it in a QImage without a copy and only
+    blits it. A buffer handed out belongs to the GUI until it is given back with release(), only
+    released buffers are drawn into, so the picture on screen is never overwritten.
+    """
+
+    BUFFERS = 3  # one shown by the GUI, one waiting to be taken, one being drawn
+
+    def __init__(self, width: int = view_width, height: int = view_height):
+        self.size = (width, height)
+        self._buffers: List[np.ndarray] = []
+        self._content: List[Optional[Tuple[int, int, int, int]]] = []  # picture rectangle of every buffer
+        self._free: List[int] = []  # indices of the buffers not held by the GUI
+        self._lock = threading.Lock()
+
+    def resize(self, width: int, height: int):
+        """
+        set the display size, can be called from the GUI thread, buffers are reallocated on the next frame
+        """
+        self.size = (max(1, width), max(1, height))
+
+    def release(self, frame: Any):
+        """
+        give back a frame returned by fit() once the GUI no longer shows it, can be called from any thread
+        """
+        with self._lock:
+            for index, buffer in enumerate(self._buffers):
+                if buffer is frame:
+                    self._free.append(index)
+                    return
+            # a buffer of the previous display size is simply dropped
+
+    def _next_buffer(self, width: int, height: int) -> int:
+        with self._lock:
+            if not self._buffers or self._buffers[0].shape[:2] != (height, width):
+                self._buffers = [np.zeros((height, width, 4), dtype=np.uint8) for _ in range(self.BUFFERS)]
+                self._content = [None] * self.BUFFERS
+                self._free = list(range(self.BUFFERS))
+            if not self._free:
+                # 所有缓冲区都还在GUI手里，宁可多分配一个也不能覆盖正在显示的画面
+                self._buffers.append(np.zeros((height, width, 4), dtype=np.uint8))
+                self._content.append(None)
+                self._free.append(len(self._buffers) - 1)
+            return self._free.pop(0)
+
+    def fit(self, image: np.ndarray) -> np.ndarray:
+        """
+        :param image: np.ndarray, RGB frame
+        :return: np.ndarray, height x width x 4 frame of the display size, not written again until released
+        """
+        width, height = self.size
+        image_height, image_width = image.shape[:2]
+        scale = min(width / image_width, height / image_height)
+        content_width, content_height = max(1, round(image_width * scale)), max(1, round(image_height * scale))
+        if (content_width, content_height) != (image_width, image_height):
+            image = cv2.resize(image, (content_width, content_height),
+                               interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+        index = self._next_buffer(width, height)
+        output = self._buffers[index]
+        if (content_width, content_height) == (width, height):
+            cv2.cvtColor(image, cv2.COLOR_RGB2BGRA, dst=output)
+            self._content[index] = (0, 0, width, height)
+            return output
+        x, y = (width - content_width) // 2, (height - content_height) // 2
+        if self._content[index] != (x, y, content_width, content_height):
+            # 黑边只在画面位置变化时重画
+            output[:] = (0, 0, 0, 255)
+            self._content[index] = (x, y, content_width, content_height)
+        output[y:y + content_height, x:x + content_width, :3] = image[..., ::-1]
+        return output
@@ -0,0 +1,28 @@
+from collections import deque
+from typing import *
+
+
+class PacketHistory:
+    """
+    Bounded ring buffer of recently sent datagrams (or the header and chunk they are sent from),
+    looked up by key to answer NACKs. The oldest is forgotten when a new one is stored in a full history.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.packets: Dict[Hashable, Any] = {}
+        self._order: Deque[Hashable] = deque()
+
+    def put(self, key: Hashable, data: Any):
+        if key not in self.packets:
+            self._order.append(key)
+            if len(self._order) > self.size:
+                self.packets.pop(self._order.popleft(), None)
+        self.packets[key] = data
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        return self.packets.get(key)
+
+    def clear(self):
+        self.packets.clear()
+        self._order.clear()
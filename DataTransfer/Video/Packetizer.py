@@ -0,0 +1,90 @@
+"""
+MTU aware packetization of an H.264 Annex B frame.
+
+The frame is cut at NAL unit boundaries: small NAL units are aggregated into one chunk
+(like RTP STAP-A), a NAL unit larger than a chunk is fragmented (like FU-A). Chunks stay
+contiguous slices of the frame, so the receiver just concatenates them, and every chunk
+is flagged with whether it starts and/or ends at a NAL unit boundary, so the complete
+NAL units of a frame missing some chunks can still be decoded.
+"""
+from typing import *
+
+import numpy as np
+
+from DataTransfer.Video.VideoPacket import FLAG_NAL_START, FLAG_NAL_END
+from config import VIDEO_CHUNK_SIZE
+
+
+def find_nal_units(data: bytes) -> List[int]:
+    """
+    :param data: bytes, Annex B byte stream
+    :return: list of int, offsets where NAL units start (their start code included)
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    if len(buffer) < 3:
+        return [0] if len(data) else []
+    # 00 00 01, a 4-byte start code 00 00 00 01 begins one byte earlier
+    positions = np.flatnonzero((buffer[:-2] == 0) & (buffer[1:-1] == 0) & (buffer[2:] == 1))
+    long_code = positions > 0
+    long_code[long_code] = buffer[positions[long_code] - 1] == 0
+    starts = (positions - long_code).tolist()
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)  # bytes before the first start code are kept with the first chunk
+    return starts
+
+
+def packetize(data: bytes, max_size: int = VIDEO_CHUNK_SIZE) -> List[Tuple[int, int, int]]:
+    """
+    :param data: bytes, an encoded frame
+    :param max_size: int, largest chunk payload
+    :return: list of (offset, length, flags) of every chunk, in order
+    """
+    bounds = find_nal_units(data) + [len(data)]
+    chunks = []
+    start = 0  # start of the chunk being aggregated
+    for nal_start, nal_end in zip(bounds[:-1], bounds[1:]):
+        if nal_end - start <= max_size:
+            continue  # the NAL unit fits in the current aggregate
+        if nal_start > start:
+            chunks.append((start, nal_start - start, FLAG_NAL_START | FLAG_NAL_END))
+            start = nal_start
+        if nal_end - nal_start > max_size:
+            # fragment the NAL unit, only the first fragment starts it and only the last one ends it
+            offset = nal_start
+            while nal_end - offset > max_size:
+                flags = FLAG_NAL_START if offset == nal_start else 0
+                chunks.append((offset, max_size, flags))
+                offset += max_size
+            if offset < nal_end:
+                chunks.append((offset, nal_end - offset, FLAG_NAL_END))
+            start = nal_end
+    if start < len(data) or not chunks:
+        chunks.append((start, len(data) - start, FLAG_NAL_START | FLAG_NAL_END))
+    return chunks
+
+
+def decodable_runs(chunks: Dict[int, bytes], flags: Dict[int, int], num_chunks: int) -> bytes:
+    """
+    the complete NAL units of a frame missing some chunks
+    :param chunks: dict, index -> chunk received
+    :param flags: dict, index -> NAL flags of the chunk
+    :param num_chunks: int, data chunks in the frame
+    :return: bytes, runs of chunks from a NAL start to a NAL end with nothing missing in between
+    """
+    runs = []
+    run = None
+    for index in range(num_chunks):
+        chunk = chunks.get(index)
+        if chunk is None:
+            run = None
+            continue
+        chunk_flags = flags.get(index, 0)
+        if chunk_flags & FLAG_NAL_START:
+            run = []
+        if run is None:
+            continue
+        run.append(chunk)
+        if chunk_flags & FLAG_NAL_END:
+            runs.extend(run)
+            run = []
+    return b''.join(runs)
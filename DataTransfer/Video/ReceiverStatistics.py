@@ -0,0 +1,72 @@
+from typing import *
+
+from DataTransfer.Video.VideoPacket import VideoPacket, timestamp_ms, wrap_diff
+
+
+class StreamStatistics:
+    """
+    RTCP-style reception statistics of the video stream of one sender.
+
+    Loss is counted against the chunks expected: every frame announces its number of chunks (parity included),
+    and a gap in frame ids counts as at least one lost chunk per missing frame. Jitter is the
+    RFC 3550 inter-arrival jitter of the first chunk of every frame.
+    """
+
+    def __init__(self):
+        self.layer: Optional[int] = None
+        self.highest_frame: Optional[int] = None
+        self.expected = 0
+        self.received = 0
+        self.bytes = 0
+        self.jitter = 0.0  # ms
+        self._last_transit = None
+        # values at the last report
+        self._reported_expected = 0
+        self._reported_received = 0
+        self._reported_bytes = 0
+        self._reported_at = timestamp_ms()
+
+    def update(self, packet: VideoPacket):
+        self.received += 1
+        self.bytes += len(packet.payload)
+        if packet.layer != self.layer:
+            # a new layer has its own frame ids
+            self.layer = packet.layer
+            self.highest_frame = None
+        if self.highest_frame is not None and wrap_diff(packet.frame_id, self.highest_frame) <= 0:
+            return  # a chunk of a frame already counted
+        if self.highest_frame is not None:
+            self.expected += wrap_diff(packet.frame_id, self.highest_frame) - 1  # frames not seen at all
+        self.highest_frame = packet.frame_id
+        self.expected += packet.num_chunks + packet.num_parity
+        transit = wrap_diff(timestamp_ms(), packet.timestamp)
+        if self._last_transit is not None:
+            self.jitter += (abs(transit - self._last_transit) - self.jitter) / 16
+        self._last_transit = transit
+
+    def restart(self):
+        """
+        count afresh from the next chunk, e.g. when a paused stream whose frames were skipped on purpose resumes
+        """
+        self.highest_frame = None
+        self._last_transit = None
+        self._reported_expected, self._reported_received = self.expected, self.received
+        self._reported_bytes, self._reported_at = self.bytes, timestamp_ms()
+
+    def report(self) -> Dict[str, float]:
+        """
+        statistics since the last report
+        :return: dict with the loss fraction, the jitter in ms and the received bit rate in bit/s
+        """
+        now = timestamp_ms()
+        expected = self.expected - self._reported_expected
+        received = self.received - self._reported_received
+        elapsed = max(1, wrap_diff(now, self._reported_at))
+        bitrate = (self.bytes - self._reported_bytes) * 8000 / elapsed
+        self._reported_expected, self._reported_received = self.expected, self.received
+        self._reported_bytes, self._reported_at = self.bytes, now
+        return {
+            'loss': round(max(0.0, 1 - received / expected), 4) if expected > 0 else 0.0,
+            'jitter': round(self.jitter, 2),
+            'bitrate': int(bitrate),
+        }
@@ -0,0 +1,192 @@
+import math
+import threading
+from typing import *
+
+import cv2
+import numpy as np
+
+from config import view_width, view_height, VIDEO_DISPLAY_RATE, VIDEO_MAX_TILES
+
+
+class TileCompositor:
+    """
+    The video grid on one persistent canvas.
+
+    The tile layout is computed only when a participant joins or leaves, and a new frame only
+    rewrites its own tile. Participants are shown in pages of `max_tiles`, in the order they joined:
+    scroll() turns the page and promote() swaps a participant (e.g. the active speaker) into the
+    page shown. The frames of the other pages are kept but not drawn. Output is throttled to the
+    display refresh rate: `output` hands out the canvas at most once per refresh, and only when a
+    tile changed since.
+    """
+
+    def __init__(self, width: int = view_width, height: int = view_height, refresh_rate: int = VIDEO_DISPLAY_RATE,
+                 max_tiles: int = VIDEO_MAX_TILES):
+        self.width = width
+        self.height = height
+        self.max_tiles = max_tiles
+        self.interval = 1.0 / refresh_rate
+        self.canvas = np.zeros((height, width, 3), dtype=np.uint8)
+        self.sources: Dict[str, np.ndarray] = {}  # latest frame of every tile, already at tile size
+        self.order: List[str] = []  # participants in grid order, cut into pages of max_tiles
+        self.first = 0  # index in order of the first tile of the page shown
+        self.layout: Dict[str, Tuple[int, int]] = {}  # layout[key] = (x, y) of the tiles on screen
+        self._promoted: Dict[str, int] = {}  # when each participant was last promoted, in promotions
+        self._promotions = 0
+        self.tile = (width, height)
+        self.dirty = False
+        self._last_output = float('-inf')
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __contains__(self, key: str):
+        return key in self.sources
+
+    def visible(self, keys: Iterable[str]) -> Set[str]:
+        """
+        :param keys: participant ids, some may have no frame here yet
+        :return: set of str, the keys that have a tile or would get one with their first frame
+        """
+        with self._lock:
+            # only the last page has free tiles, a new participant is added at its end
+            free = self.max_tiles - len(self.layout)
+            shown = set()
+            for key in keys:
+                if key in self.layout:
+                    shown.add(key)
+                elif key not in self.sources and free > 0:
+                    free -= 1
+                    shown.add(key)
+            return shown
+
+    def tile_size(self, key: str = None) -> Tuple[int, int]:
+        """
+        :param key: str, participant id, a participant without a tile yet gets the size it would have
+        :return: (width, height) the frames of the participant are shown at
+        """
+        if key is None or key in self.sources or len(self.layout) >= self.max_tiles:
+            return self.tile
+        grid_size = int(math.ceil(math.sqrt(len(self.layout) + 1)))
+        return self.width // grid_size, self.height // grid_size
+
+    def fit(self, image: np.ndarray) -> np.ndarray:
+        """
+        scale a frame to the current tile size, callers do it before update() to keep it out of the lock
+        """
+        tile_width, tile_height = self.tile
+        if image.shape[1] == tile_width and image.shape[0] == tile_height:
+            return image
+        return cv2.resize(image, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+
+    def _last_page(self) -> int:
+        return max(0, (len(self.order) - 1) // self.max_tiles * self.max_tiles)
+
+    def _relayout(self):
+        self.first = min(self.first, self._last_page())
+        shown = self.order[self.first:self.first + self.max_tiles]
+        grid_size = int(math.ceil(math.sqrt(max(1, len(shown)))))
+        self.tile = (self.width // grid_size, self.height // grid_size)
+        tile_width, tile_height = self.tile
+        self.layout = {key: ((index % grid_size) * tile_width, (index // grid_size) * tile_height)
+                       for index, key in enumerate(shown)}
+        self.canvas[:] = 0
+        for key in shown:
+            # 其他页的画面等翻到时再缩放
+            self._draw(key, self.sources[key])
+        self.dirty = True
+
+    def _draw(self, key: str, image: np.ndarray) -> bool:
+        image = self.sources[key] = self.fit(image)
+        if key not in self.layout:
+            return False
+        x, y = self.layout[key]
+        self.canvas[y:y + image.shape[0], x:x + image.shape[1]] = image
+        return True
+
+    def update(self, key: str, image: np.ndarray):
+        """
+        :param key: str, participant id
+        :param image: np.ndarray, RGB frame, scaled to the tile if it is not yet
+        """
+        with self._lock:
+            if key not in self.sources:
+                self.sources[key] = image
+                self.order.append(key)
+                self._relayout()
+            elif self._draw(key, image):
+                self.dirty = True
+
+    def remove(self, key: str) -> bool:
+        """
+        :return: bool, True if the key had a tile
+        """
+        with self._lock:
+            if self.sources.pop(key, None) is None:
+                return False
+            self.order.remove(key)
+            self._promoted.pop(key, None)
+            self._relayout()
+            return True
+
+    def clear(self):
+        with self._lock:
+            self.sources.clear()
+            self.order.clear()
+            self._promoted.clear()
+            self.first = 0
+            self._relayout()
+
+    def scroll(self, pages: int) -> bool:
+        """
+        :param pages: int, pages to turn, negative to go back
+        :return: bool, True if another page is shown
+        """
+        with self._lock:
+            first = min(max(0, self.first + pages * self.max_tiles), self._last_page())
+            if first == self.first:
+                return False
+            self.first = first
+            self._relayout()
+            return True
+
+    def promote(self, key: str) -> bool:
+        """
+        bring a participant into the page shown, in place of the tile promoted least recently
+        :return: bool, True if the participant was on another page
+        """
+        with self._lock:
+            if key not in self.sources:
+                return False
+            self._promotions += 1
+            self._promoted[key] = self._promotions
+            if key in self.layout:
+                return False
+            shown = self.order[self.first:self.first + self.max_tiles]
+            # among tiles never promoted the last one of the page goes
+            replaced = min(reversed(shown), key=lambda shown_key: self._promoted.get(shown_key, 0))
+            index, replaced_index = self.order.index(key), self.order.index(replaced)
+            self.order[index], self.order[replaced_index] = replaced, key
+            self._relayout()
+            return True
+
+    @property
+    def next_output(self) -> Optional[float]:
+        """
+        when output() will next hand out the canvas, None if nothing changed
+        """
+        return self._last_output + self.interval if self.dirty else None
+
+    def output(self, now: float, render: Callable[[np.ndarray], Any] = np.copy) -> Any:
+        """
+        :param now: float, time.time()
+        :param render: called with the canvas while no tile is written, its result is handed out
+        :return: render(canvas) if a tile changed and a refresh is due, else None
+        """
+        with self._lock:
+            if not self.dirty or now - self._last_output < self.interval:
+                return None
+            self.dirty = False
+            self._last_output = now
+            return render(self.canvas)
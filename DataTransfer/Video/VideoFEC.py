@@ -0,0 +1,82 @@
+"""
+Interleaved XOR parity for the chunks of a video frame.
+
+A frame of n data chunks sent with k parity chunks is protected in k interleaved groups:
+parity chunk p (sent with sequence number n + p) is the XOR of the units of the data chunks
+i with i % k == p, where the unit of a chunk is | offset in frame (I) | payload length (H) | payload |,
+zero padded to the longest unit of the frame, so a rebuilt chunk also knows where it goes. One loss per group can be rebuilt, so any burst of up to
+k consecutive lost chunks is recovered without a retransmission.
+"""
+import math
+import struct
+from typing import *
+
+import numpy as np
+
+from config import VIDEO_FEC_MAX_RATIO
+
+UNIT_HEADER_FORMAT = "!IH"
+UNIT_HEADER_SIZE = struct.calcsize(UNIT_HEADER_FORMAT)
+
+
+def parity_count(num_chunks: int, loss: float) -> int:
+    """
+    parity chunks to send with a frame for the loss fraction receivers report
+    """
+    if loss < 0.01:
+        return 0
+    count = min(max(1, math.ceil(2 * loss * num_chunks)), max(1, math.ceil(VIDEO_FEC_MAX_RATIO * num_chunks)))
+    return min(count, 255)  # the header holds the count in one byte
+
+
+def _units(chunks: Sequence[Tuple[int, bytes]], width: int) -> np.ndarray:
+    block = np.zeros((len(chunks), width), dtype=np.uint8)
+    for row, (offset, chunk) in enumerate(chunks):
+        struct.pack_into(UNIT_HEADER_FORMAT, block[row], 0, offset, len(chunk))
+        block[row, UNIT_HEADER_SIZE:UNIT_HEADER_SIZE + len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+    return block
+
+
+def make_parity(chunks: Sequence[Tuple[int, bytes]], count: int) -> List[bytes]:
+    """
+    :param chunks: (offset, payload) of the data chunks of a frame
+    :param count: int, number of parity chunks k
+    :return: list of k parity chunks
+    """
+    if count <= 0 or not chunks:
+        return []
+    width = UNIT_HEADER_SIZE + max(len(chunk) for _, chunk in chunks)
+    groups = math.ceil(len(chunks) / count)
+    # row g * count + p of the padded block belongs to group p, XOR all the groups at once
+    block = np.zeros((groups * count, width), dtype=np.uint8)
+    block[:len(chunks)] = _units(chunks, width)
+    parity = np.bitwise_xor.reduce(block.reshape(groups, count, width), axis=0)
+    return [row.tobytes() for row in parity]
+
+
+def recover(chunks: Dict[int, Tuple[int, bytes]], parities: Dict[int, bytes], num_chunks: int,
+            count: int) -> Dict[int, Tuple[int, bytes]]:
+    """
+    rebuild the data chunks that are the only loss of their group
+    :param chunks: dict, index -> (offset, payload) of the data chunks received
+    :param parities: dict, parity index -> parity chunk received
+    :param num_chunks: int, data chunks in the frame
+    :param count: int, parity chunks in the frame
+    :return: dict, index -> (offset, payload) of the data chunks rebuilt
+    """
+    rebuilt = {}
+    for group, parity in parities.items():
+        members = range(group, num_chunks, count)
+        missing = [index for index in members if index not in chunks]
+        if len(missing) != 1:
+            continue
+        width = len(parity)
+        others = [chunks[index] for index in members if index != missing[0]]
+        block = np.zeros((len(others) + 1, width), dtype=np.uint8)
+        block[0] = np.frombuffer(parity, dtype=np.uint8)
+        if others:
+            block[1:] = _units(others, width)
+        unit = np.bitwise_xor.reduce(block, axis=0).tobytes()
+        offset, length = struct.unpack_from(UNIT_HEADER_FORMAT, unit, 0)
+        rebuilt[missing[0]] = (offset, unit[UNIT_HEADER_SIZE:UNIT_HEADER_SIZE + length])
+    return rebuilt
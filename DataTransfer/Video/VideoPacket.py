@@ -0,0 +1,130 @@
+"""
+Video datagram format shared by VideoSender, VideoReceiver and the conference server:
+
+| layer (B) | flags (B) | frame id (I) | sequence number in frame (I) | offset of the chunk in frame (I)
+| capture timestamp in ms (I) | frame length (Q) | data chunks in frame (H) | parity chunks in frame (B)
+| id length (B) | participant id | chunk |
+
+Frame ids count the frames of one layer, receivers use them to tell lost frames from late chunks.
+Sequence numbers from the number of data chunks on are parity chunks, see VideoFEC.
+Data chunks are cut at NAL unit boundaries where possible, see Packetizer.
+
+Control messages (receiver reports...) travel on the same socket as JSON objects, they always
+start with b'{' which no video header does as long as there are less than 123 layers.
+"""
+import struct
+from typing import *
+
+from DataTransfer.Audio.AudioPacket import timestamp_ms, wrap_diff
+
+HEADER_FORMAT = "!BBIIIIQHBB"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# flags
+FLAG_KEYFRAME = 0x01  # the chunk belongs to a keyframe, a decoder can start from it
+FLAG_RETRANSMISSION = 0x02  # the chunk is sent again after a NACK
+FLAG_NAL_START = 0x04  # the chunk starts with a NAL unit
+FLAG_NAL_END = 0x08  # the chunk ends with a NAL unit
+
+
+class VideoPacket(NamedTuple):
+    layer: int
+    flags: int
+    frame_id: int
+    sequence_number: int
+    offset: int
+    timestamp: int
+    data_len: int
+    num_chunks: int
+    num_parity: int
+    participant_id: str
+    payload: bytes
+
+    @property
+    def is_keyframe(self) -> bool:
+        return bool(self.flags & FLAG_KEYFRAME)
+
+    @property
+    def is_parity(self) -> bool:
+        return self.sequence_number >= self.num_chunks
+
+
+def is_control(data: bytes) -> bool:
+    """
+    tell a JSON control message from a video chunk
+    """
+    return data[:1] == b'{'
+
+
+def header_size(participant_id: bytes) -> int:
+    """
+    length of the header (participant id included) in front of every chunk of a sender
+    """
+    return HEADER_SIZE + len(participant_id)
+
+
+def pack_header_into(buffer, position: int, participant_id: bytes, layer: int, frame_id: int, sequence_number: int,
+                     timestamp: int, data_len: int, flags: int = 0, num_chunks: int = 1, num_parity: int = 0,
+                     offset: int = 0) -> int:
+    """
+    write the header of a datagram into a writable buffer, the chunk itself is sent after it
+    without being copied (socket.sendmsg scatter-gather), see pack_video for the parameters
+    :param buffer: bytearray or memoryview
+    :param position: int, where the header starts in buffer
+    :return: int, header length
+    """
+    struct.pack_into(HEADER_FORMAT, buffer, position, layer, flags, frame_id & 0xFFFFFFFF, sequence_number, offset,
+                     timestamp & 0xFFFFFFFF, data_len, num_chunks, num_parity, len(participant_id))
+    start = position + HEADER_SIZE
+    buffer[start:start + len(participant_id)] = participant_id
+    return HEADER_SIZE + len(participant_id)
+
+
+def pack_video(participant_id: bytes, layer: int, frame_id: int, sequence_number: int, timestamp: int,
+               data_len: int, payload: bytes, flags: int = 0, num_chunks: int = 1, num_parity: int = 0,
+               offset: int = 0) -> bytes:
+    """
+    :param participant_id: bytes, utf-8 encoded id of the sender
+    :param layer: int, simulcast layer, 0 is the lowest resolution
+    :param frame_id: int, frame counter of the layer, wraps around at 2^32
+    :param sequence_number: int, index of the chunk in its frame
+    :param timestamp: int, capture time of the frame from timestamp_ms()
+    :param data_len: int, length of the whole encoded frame
+    :param payload: bytes, the chunk
+    :param flags: int
+    :param num_chunks: int, data chunks the frame is cut into
+    :param num_parity: int, parity chunks sent after them
+    :param offset: int, position of a data chunk in the frame, 0 for parity chunks
+    :return: bytes
+    """
+    header = bytearray(header_size(participant_id))
+    pack_header_into(header, 0, participant_id, layer, frame_id, sequence_number, timestamp, data_len, flags,
+                     num_chunks, num_parity, offset)
+    return bytes(header) + payload
+
+
+def mark_retransmission(data: bytes) -> bytes:
+    """
+    set FLAG_RETRANSMISSION in a packed datagram, or just its header
+    """
+    data = bytearray(data)
+    data[1] |= FLAG_RETRANSMISSION
+    return bytes(data)
+
+
+def unpack_video(data: bytes) -> VideoPacket:
+    """
+    :param data: bytes, a whole datagram
+    :return: VideoPacket
+    :raise ValueError: if the datagram is too short to hold the header
+    """
+    try:
+        layer, flags, frame_id, sequence_number, chunk_offset, timestamp, data_len, num_chunks, num_parity, id_len = \
+            struct.unpack_from(HEADER_FORMAT, data, 0)
+    except struct.error:
+        raise ValueError(f'Video packet too short: {len(data)} bytes')
+    offset = HEADER_SIZE
+    participant_id = data[offset:offset + id_len].decode('utf-8', errors='replace')
+    offset += id_len
+    return VideoPacket(layer, flags, frame_id, sequence_number, chunk_offset, timestamp, data_len, num_chunks,
+                       num_parity, participant_id, data[offset:])
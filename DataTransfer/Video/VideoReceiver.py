@@ -1,47 +1,237 @@
-import math
+import json
 import socket
-import struct
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import av
 import cv2
 import select
-from PIL import Image
-from PyQt5.QtCore import pyqtSignal
+
+from DataTransfer.Video.BitrateController import BitrateController
+from DataTransfer.Video.DecodeQueue import DecodeQueue
+from DataTransfer.Video.FrameAssembler import FrameAssembler
+from DataTransfer.Video.FrameMailbox import FrameMailbox
+from DataTransfer.Video.Letterbox import Letterbox
+from DataTransfer.Video.ReceiverStatistics import StreamStatistics
+from DataTransfer.Video.TileCompositor import TileCompositor
+from DataTransfer.Video.VideoPacket import unpack_video, is_control
 from config import *
-from util import overlay_camera_images
 
 
 class VideoReceiver:
-    def __init__(self, socket_connection: socket.socket, update_signal: pyqtSignal(Image.Image)):
+    LOCAL_VIEW = ''  # tile key of our own camera, no participant id is empty
+
+    def __init__(self, socket_connection: socket.socket, update_signal: FrameMailbox,
+                 report_addr: Tuple[str, int] = None, feedback: Callable[[dict], None] = None):
         self.update_signal = update_signal
         self.sock = socket_connection
+        # 接收报告发往的地址（服务器），服务器据此为我们挑选simulcast层并转发给发送者
+        self.report_addr = report_addr
+        self._last_report = 0.0
+        self.statistics: Dict[str, StreamStatistics] = {}  # 每个发送者的丢包率、抖动、码率统计
+        # 根据丢包估计下行带宽
+        self.bandwidth_estimator = BitrateController(VIDEO_MIN_BITRATE, VIDEO_DOWNLINK_BANDWIDTH)
+        # 其他接收者关于我们自己视频流的反馈（接收报告、关键帧请求）交给发送端（VideoSender.handle_feedback）
+        self.feedback = feedback
+        # 按帧号重组数据块，丢失的块通过NACK请求重传
+        self.assembler = FrameAssembler()
+        self._keyframe_requested: Dict[str, float] = {}  # time of the last keyframe request per stream
         self.sock.setblocking(False)
-        self.buffers = {}
-        self.expected_sequences = {}
-        self.received_chunks = {}
-        self.frames = {}
+        # 视频网格画布，每帧只重绘对应的格子
+        self.compositor = TileCompositor()
+        # 在工作线程里缩放到显示区域大小，GUI线程只需绘制，GUI换下的缓冲区经邮箱还给letterbox
+        self.letterbox = Letterbox()
+        if isinstance(update_signal, FrameMailbox):
+            update_signal.release = self.letterbox.release
+        # 不显示的流（窗口最小化、没有格子）只解码关键帧，服务器也只转发关键帧
+        self.view_visible = True
+        self.paused: Set[str] = set()
+        self._visibility_lock = threading.Lock()
         self._running = False
         self._thread = None
+        # 解码线程更新了画面但被刷新率节流时，唤醒阻塞在select里的接收线程，让它按新的刷新时刻等待
+        self._wakeup_r, self._wakeup_w = None, None
         self.timeout = 5  # 超时时间
         self.time_record = {} # 超时删除
+        self._left: Set[str] = set()  # participants who left the meeting, removed by the receiving thread
+        self._next_housekeeping = 0.0  # 下次检查超时客户端和发送接收报告的时间
+        # 本地预览直接取摄像头采集的画面，不再把自己的视频流发回给自己解码
+        self.camera = None
+        self._next_preview = 0.0
         # 用于存储解码器的字典
         self.decoders: Dict[str,  av.codec.context.CodecContext] = {}
+        # 解码交给线程池（PyAV解码时释放GIL），收包和组帧不会被解码阻塞
+        self.decode_pool: Optional[ThreadPoolExecutor] = None
+        self.decode_queues: Dict[str, DecodeQueue] = {}
+        self._queue_lock = threading.Lock()
+
+    def set_view_size(self, width: int, height: int):
+        """
+        size of the widget the grid is shown in, called from the GUI thread
+        """
+        self.letterbox.resize(width, height)
+
+    def set_view_visible(self, visible: bool):
+        """
+        the video widget was shown or hidden (window minimised), called from the GUI thread
+        """
+        self.view_visible = visible
+        self._update_visibility()
+
+    def scroll_tiles(self, pages: int):
+        """
+        show another page of the grid when the participants do not fit on one, called from the GUI thread
+        """
+        if self.compositor.scroll(pages):
+            self._update_visibility()
+            self._present()
+
+    def set_active_speaker(self, client_id: str):
+        """
+        bring the active speaker into the page shown
+        """
+        if self.compositor.promote(client_id):
+            self._update_visibility()
+            self._present()
 
-    @staticmethod
-    def _unpack_data(data):
-        offset = 0
-        client_id_len = struct.unpack_from("I", data, offset)[0]
-        offset += struct.calcsize("I")
-        client_id = data[offset:offset + client_id_len].decode('utf-8')
-        offset += client_id_len
-        data_len = struct.unpack_from("Q", data, offset)[0]
-        offset += struct.calcsize("Q")
-        sequence_number = struct.unpack_from("I", data, offset)[0]
-        offset += struct.calcsize("I")
-        chunk_data = data[offset:]
-        return client_id, data_len, sequence_number, chunk_data
+    def _update_visibility(self):
+        """
+        pause the streams that have no tile on screen and resume the others, asking for a keyframe
+        to restart their decoding
+        """
+        with self._visibility_lock:
+            with self._queue_lock:
+                streams = set(self.decode_queues)
+            visible = self.compositor.visible(streams) if self.view_visible else set()
+            paused = streams - visible
+            resumed = (self.paused - paused) & streams
+            newly_paused = paused - self.paused
+            self.paused = paused
+            for client_id in resumed:
+                # 暂停期间只收到关键帧，跳过的帧不算丢包，超时也从恢复时重新计算
+                if client_id in self.statistics:
+                    self.statistics[client_id].restart()
+                self.time_record[client_id] = time.time()
+        if self.report_addr is None:
+            return
+        for client_id in newly_paused:
+            self._send_control({'type': MessageType.VIDEO_PAUSE.value, 'client_id': client_id, 'paused': True})
+        for client_id in resumed:
+            self._send_control({'type': MessageType.VIDEO_PAUSE.value, 'client_id': client_id, 'paused': False})
+            self._request_keyframe(client_id)
+
+    def set_local_camera(self, camera):
+        """
+        show our own captured frames in our grid
+        :param camera: Camera the VideoSender encodes from, None to stop the self view
+        """
+        self.camera = camera
+
+    def _show_local_view(self):
+        """
+        put the latest captured frame into the grid, drop it once the camera is gone
+        """
+        camera = self.camera
+        ret, frame = camera.get_frame() if camera and self.view_visible else (False, None)
+        if ret and frame is not None:
+            new = self.LOCAL_VIEW not in self.compositor
+            self.compositor.update(self.LOCAL_VIEW, self.compositor.fit(frame))
+            if new:
+                self._update_visibility()  # our own tile may take the last free one
+        elif camera is None and self.compositor.remove(self.LOCAL_VIEW):
+            self._show_empty()
+            self._update_visibility()
+        self._present()
+
+    def _send_report(self):
+        """
+        RTCP-style receiver report: loss, jitter and bit rate of every stream received,
+        plus the tile size and the downlink bandwidth estimated from them
+        """
+        now = time.time()
+        if self.report_addr is None or now - self._last_report < VIDEO_REPORT_INTERVAL:
+            return
+        self._last_report = now
+        streams = {client_id: statistics.report() for client_id, statistics in self.statistics.items()
+                   if client_id not in self.paused}
+        if streams:
+            self.bandwidth_estimator.update(max(stream['loss'] for stream in streams.values()),
+                                            sum(stream['bitrate'] for stream in streams.values()))
+        tile_width, tile_height = self.compositor.tile_size()
+        report = {
+            'type': MessageType.RECEIVER_REPORT.value,
+            'tile': [tile_width, tile_height],
+            'bandwidth': self.bandwidth_estimator.bitrate,
+            'streams': streams,
+        }
+        try:
+            self.sock.sendto(json.dumps(report).encode(), self.report_addr)
+        except OSError as e:
+            print(f"[Error]: Failed to send receiver report: {e}")
+
+    def _handle_control(self, data: bytes):
+        """
+        feedback about our own stream (receiver reports, keyframe requests),
+        forwarded by the server or sent by the P2P peer
+        """
+        try:
+            message = json.loads(data.decode())
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return
+        if self.feedback:
+            self.feedback(message)
+
+    def _send_control(self, message: dict):
+        try:
+            self.sock.sendto(json.dumps(message).encode(), self.report_addr)
+        except OSError as e:
+            print(f"[Error]: Failed to send {message['type']}: {e}")
+
+    def _request_keyframe(self, client_id: str):
+        """
+        ask the sender of a stream for a keyframe (PLI), the decoder cannot go on without one
+        """
+        now = time.time()
+        if self.report_addr is None or now - self._keyframe_requested.get(client_id, 0.0) < VIDEO_KEYFRAME_REQUEST_INTERVAL:
+            return
+        self._keyframe_requested[client_id] = now
+        self._send_control({
+            'type': MessageType.KEYFRAME_REQUEST.value,
+            'client_id': client_id,
+        })
+
+    def _send_nacks(self, client_id: str, now: float):
+        """
+        ask for the chunks missing in the frames of a stream (NACK), the server answers from its
+        cache or passes the request on to the sender
+        """
+        if self.report_addr is None:
+            return
+        for layer, frame_id, sequences in self.assembler.missing(client_id, now):
+            self._send_control({
+                'type': MessageType.NACK.value,
+                'client_id': client_id,
+                'layer': layer,
+                'frame_id': frame_id,
+                'sequences': sequences,
+            })
+
+    def _check_frames(self):
+        """
+        give up frames whose missing chunks did not come in time, their complete slices are still shown
+        """
+        for client_id, partial in self.assembler.expire(time.time()):
+            if partial and client_id in self.decoders:
+                # 解码器会隐藏丢失的slice
+                self._submit_frame(client_id, partial, False)
+            self._request_keyframe(client_id)
+
+    def reconnect(self, address: Tuple[str, int]):
+        """
+        切换接收报告的目标地址(服务器或者其他客户端)
+        """
+        self.report_addr = address
 
     def _create_decoder(self, client_id):
         # 为每个客户端创建解码器
@@ -55,118 +245,245 @@ class VideoReceiver:
         }
         self.decoders[client_id] = codec
 
+    def participant_left(self, client_id: str):
+        """
+        drop the stream of a participant who left the meeting, a paused stream never times out,
+        called from another thread, the stream is removed at the next housekeeping
+        """
+        self._left.add(client_id)
+
     def _check_timeouts(self):
+        while self._left:
+            self.remove_client(self._left.pop())
         current_time = time.time()
         for client_id in list(self.time_record.keys()):
+            if client_id in self.paused:
+                # 暂停的流只有关键帧，丢两个就会超时，参会者离开时由participant_left移除
+                continue
             if current_time - self.time_record[client_id] > self.timeout:
                 print(f"Client {client_id} timed out")
                 self.remove_client(client_id)
 
+    def _wait_time(self, now: float) -> float:
+        """
+        seconds until the next timer is due: the deadline of a frame in flight, a display refresh
+        held back by the throttle, the self view or the housekeeping
+        """
+        due = self._next_housekeeping
+        if self.camera is not None or self.LOCAL_VIEW in self.compositor:
+            due = min(due, self._next_preview)
+        if self.view_visible and self.compositor.next_output is not None:
+            due = min(due, self.compositor.next_output)
+        if self.assembler.next_deadline is not None:
+            due = min(due, self.assembler.next_deadline)
+        return max(0.0, due - now)
+
+    def _run_timers(self, now: float):
+        """
+        work driven by time rather than by packets, so a packet never scans every stream
+        """
+        if self.assembler.next_deadline is not None and now >= self.assembler.next_deadline:
+            self._check_frames()
+        if now >= self._next_preview:
+            self._next_preview = now + 1.0 / VIDEO_FRAME_RATE
+            self._show_local_view()
+        self._present()
+        if now >= self._next_housekeeping:
+            self._next_housekeeping = now + VIDEO_REPORT_INTERVAL
+            self._check_timeouts()
+            self._send_report()
+
     def _process_data(self):
         while self._running:
             try:
-                ready = select.select([self.sock], [], [], 1)
-                if ready[0]:
+                ready = select.select([self.sock, self._wakeup_r], [], [], self._wait_time(time.time()))[0]
+                if self._wakeup_r in ready:
+                    self._wakeup_r.recv(4096)
+                if self.sock in ready:
                     data, _ = self.sock.recvfrom(65536)
                     if not data or data == b'Cancelled':
                         break
                 else:
-                    self._check_timeouts()
+                    self._run_timers(time.time())
                     continue
             except OSError:
                 break
-            self._check_timeouts()
-            client_id, data_len, sequence_number, chunk_data = self._unpack_data(data)
+            self._run_timers(time.time())
+            if is_control(data):
+                self._handle_control(data)
+                continue
+            try:
+                packet = unpack_video(data)
+            except ValueError:
+                continue
+            client_id = packet.participant_id
+            if client_id not in self.paused:
+                # 暂停的流只转发关键帧，统计会把中间的帧都当成丢包，拖低发送端码率和下行带宽估计
+                self.statistics.setdefault(client_id, StreamStatistics()).update(packet)
 
             # 超时删除
-            self.time_record[client_id] = time.time()
+            now = time.time()
+            self.time_record[client_id] = now
 
             # 初始化新客户端
-            if client_id not in self.expected_sequences:
-                self.expected_sequences[client_id] = 0
-                self.received_chunks[client_id] = {}
-                self.buffers[client_id] = b''
+            if client_id not in self.decoders:
                 self._create_decoder(client_id)
 
-            self.received_chunks[client_id][sequence_number] = chunk_data
-            # 按序处理数据块
-            while self.expected_sequences[client_id] in self.received_chunks[client_id]:
-                self.buffers[client_id] += self.received_chunks[client_id].pop(
-                    self.expected_sequences[client_id]
-                )
-                self.expected_sequences[client_id] += 1
+            ready_frames = self.assembler.add(packet, now)
+            if self.assembler.waiting(client_id) and not packet.is_keyframe:
+                # 从中途加入或丢帧后，解码器只能从关键帧开始
+                self._request_keyframe(client_id)
+            self._send_nacks(client_id, now)
+            for data, keyframe in ready_frames:
+                self._submit_frame(client_id, data, keyframe)
 
-            if len(self.buffers[client_id]) < data_len:
-                continue
+    def _submit_frame(self, client_id: str, data: bytes, keyframe: bool):
+        """
+        queue a frame for the decode worker of its stream, never blocks on decoding
+        """
+        with self._queue_lock:
+            new = client_id not in self.decode_queues
+            queue = self.decode_queues.setdefault(client_id, DecodeQueue(VIDEO_DECODE_QUEUE_SIZE))
+            if client_id in self.paused and not keyframe:
+                # 不显示的流只解码关键帧，恢复显示时重新请求关键帧
+                queue.waiting = True
+                needs_keyframe = False
+            else:
+                needs_keyframe = queue.push(data, keyframe)
+            start = not queue.busy and bool(queue.frames)
+            if start:
+                queue.busy = True
+        if new:
+            self._update_visibility()
+        if needs_keyframe:
+            # 解码跟不上，丢掉的帧之后只能从关键帧重新开始
+            self._request_keyframe(client_id)
+        if start:
+            self.decode_pool.submit(self._drain_queue, client_id, queue)
 
-            try:
-                # 解码视频帧
-                decoder = self.decoders[client_id]
-                packets = decoder.parse(self.buffers[client_id])
-                for packet in packets:
-                    # decode方法来自C扩展，PyCharm有警告但没影响
-                    frames = decoder.decode(packet)
-                    for frame in frames:
-                        # 转换为numpy数组
-                        img = frame.to_ndarray(format='rgb24')
-                        self.frames[client_id] = img
-
-                        # 显示所有摄像头画面
-                        camera_images = list(self.frames.values())
-                        if camera_images:
-                            grid_size = int(math.ceil(math.sqrt(len(camera_images))))
-                            grid_image = overlay_camera_images(camera_images, (grid_size, grid_size))
-                            if USE_GUI:
-                                grid_image_pil = Image.fromarray(grid_image)
-                                self.update_signal.emit(grid_image_pil)
-                            else:
-                                grid_image = cv2.cvtColor(grid_image, cv2.COLOR_RGB2BGR)
-                                cv2.imshow('Video Grid', grid_image)
-                            if cv2.waitKey(1) & 0xFF == ord('q'):
-                                self._running = False
-                                break
-            except Exception as e:
-                pass
-
-            # 清理缓冲区
-            self.buffers[client_id] = b''
-            self.expected_sequences[client_id] = 0
+    def _drain_queue(self, client_id: str, queue: DecodeQueue):
+        """
+        decode worker: decode the frames of one stream until its queue is empty
+        """
+        while True:
+            with self._queue_lock:
+                data = queue.pop()
+                if data is None:
+                    queue.busy = False
+                    return
+            if not self._decode_frame(client_id, data):
+                with self._queue_lock:
+                    queue.fail()
+                self._request_keyframe(client_id)
+
+    def _decode_frame(self, client_id: str, data: bytes) -> bool:
+        """
+        :return: bool, False if the decoder failed and needs a keyframe
+        """
+        decoder = self.decoders.get(client_id)
+        if decoder is None:
+            return True  # the client left
+        try:
+            # 解码视频帧
+            packets = decoder.parse(data)
+            for packet in packets:
+                # decode方法来自C扩展，PyCharm有警告但没影响
+                frames = decoder.decode(packet)
+                for frame in frames:
+                    # 颜色转换和缩放到格子大小在同一次swscale里完成
+                    tile_width, tile_height = self.compositor.tile_size(client_id)
+                    img = frame.reformat(tile_width, tile_height, 'rgb24').to_ndarray()
+                    with self._queue_lock:
+                        if client_id not in self.decode_queues:
+                            return True  # the client left while decoding
+                        new = client_id not in self.compositor
+                        self.compositor.update(client_id, img)
+                    if new:
+                        self._update_visibility()
+                    self._present()
+        except Exception as e:
+            # 解码失败，解码器要从下一个关键帧重新开始
+            print(f"Decoding error from {client_id}: {e}")
+            return False
+        return True
+
+    def _present(self):
+        """
+        显示所有摄像头画面，最多每次屏幕刷新一次
+        """
+        if not self.view_visible:
+            return
+        if USE_GUI:
+            # 发给GUI的是可以直接包装成QImage的缓冲区
+            frame = self.compositor.output(time.time(), self.letterbox.fit)
+            if frame is not None:
+                self.update_signal.post(frame)
+        else:
+            grid_image = self.compositor.output(time.time(), lambda canvas: cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR))
+            if grid_image is not None:
+                cv2.imshow('Video Grid', grid_image)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    self._running = False
+        if self.compositor.next_output is not None and threading.current_thread() is not self._thread:
+            # the receiving thread flushes the held back canvas at the next refresh
+            self._wake()
+
+    def _wake(self):
+        """
+        make the receiving thread recompute how long it waits, called from the other threads
+        """
+        try:
+            self._wakeup_w.send(b'\x00')
+        except (AttributeError, OSError):
+            pass  # not running, or wakeups are already pending
+
+    def _show_empty(self):
+        """
+        the last tile is gone
+        """
+        if len(self.compositor):
+            return
+        if USE_GUI:
+            self.update_signal.post(None)
+            print("No camera images to display")
+        else:
+            print("No more frames to display")
+            cv2.destroyAllWindows()
 
     def remove_client(self, client_id):
+        with self._queue_lock:
+            self.decode_queues.pop(client_id, None)
+            removed = self.compositor.remove(client_id)
         self.decoders.pop(client_id, None)
-        self.buffers.pop(client_id, None)
-        self.expected_sequences.pop(client_id, None)
-        self.received_chunks.pop(client_id, None)
-        self.frames.pop(client_id, None)
+        self.assembler.remove(client_id)
         self.time_record.pop(client_id, None)
+        self.statistics.pop(client_id, None)
+        self._keyframe_requested.pop(client_id, None)
         #显示所有摄像头画面
-        if USE_GUI:
-            camera_images = list(self.frames.values())
-            if camera_images:
-                grid_size = int(math.ceil(math.sqrt(len(camera_images))))
-                grid_image = overlay_camera_images(camera_images, (grid_size, grid_size))
-                grid_image_pil = Image.fromarray(grid_image)
-                self.update_signal.emit(grid_image_pil)
-            else:
-                self.update_signal.emit(Image.new('RGB', (camera_width, camera_height)))
-                print("No camera images to display")
-        else:
-            if not self.frames:
-                print("No more frames to display")
-                cv2.destroyAllWindows()
+        self._update_visibility()
+        if removed:
+            self._show_empty()
+            self._present()
 
     def clear(self):
+        with self._queue_lock:
+            self.decode_queues.clear()
+            self.compositor.clear()
         self.decoders.clear()
-        self.buffers.clear()
-        self.expected_sequences.clear()
-        self.received_chunks.clear()
-        self.frames.clear()
+        self.paused.clear()
+        self.assembler.clear()
         self.time_record.clear()
+        self.statistics.clear()
+        self._keyframe_requested.clear()
 
     def start(self):
         if self._running:
             raise RuntimeError("VideoReceiver is already running")
         self._running = True
+        self.decode_pool = ThreadPoolExecutor(max_workers=VIDEO_DECODE_THREADS, thread_name_prefix='video-decode')
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
         self._thread = threading.Thread(target=self._process_data)
         self._thread.start()
 
@@ -174,6 +491,11 @@ class VideoReceiver:
         if not self._running:
             return
         self._running = False
+        self._wake()
         self._thread.join()
+        self.decode_pool.shutdown(wait=True)
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+        self._wakeup_r, self._wakeup_w = None, None
         cv2.destroyAllWindows()
         self.clear()
@@ -1,17 +1,23 @@
 import io
-import struct
 import threading
 import time
 import socket
 
 import av
 import cv2
+from av.video.frame import PictureType
 
+from DataTransfer.Video.BitrateController import BitrateController
+from DataTransfer.Video.PacketHistory import PacketHistory
+from DataTransfer.Video.Packetizer import packetize
+from DataTransfer.Video.VideoFEC import make_parity, parity_count
+from DataTransfer.Video.VideoPacket import pack_header_into, header_size, mark_retransmission, timestamp_ms, \
+    FLAG_KEYFRAME
 from config import *
 
 
 class VideoSender:
-    def __init__(self, camera, socket_connection: socket.socket, client_id: str=None, target_addr: Tuple[str, int] = None, frame_rate: int=20):
+    def __init__(self, camera, socket_connection: socket.socket, client_id: str=None, target_addr: Tuple[str, int] = None, frame_rate: int=VIDEO_FRAME_RATE):
         self.camera = camera
         self.client_id = client_id.encode('utf-8') if client_id else b''
         self.frame_rate = frame_rate
@@ -20,45 +26,176 @@ class VideoSender:
         self._running = False
         self._thread = None
         self.sock_lock = threading.Lock()
-        # 用于向自己发送数据
-        self.loopback_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        # 初始化编码器
-        self.codec_context = self._create_codec_context()
+        # 服务器转发时同时编码多个分辨率层（simulcast），P2P时只发送最高层
+        self.simulcast = True
+        # 拥塞控制：根据接收报告调整码率、帧率和分辨率
+        self.bitrate_controller = BitrateController(VIDEO_MIN_BITRATE, VIDEO_SIMULCAST_LAYERS[-1][2])
+        self.send_frame_rate = frame_rate
+        self.layer_sizes = [(width, height) for width, height, _ in VIDEO_SIMULCAST_LAYERS]
+        self._applied_bitrate = self.bitrate_controller.bitrate
+        self._last_reconfigure = 0.0
+        self.frame_ids = [0] * len(VIDEO_SIMULCAST_LAYERS)
+        self.keyframe_layers: Set[int] = set()  # layers whose next frame is forced to be a keyframe
+        self.loss_fraction = 0.0  # loss reported by the receivers of our stream
+        # 最近发送的数据块，用于响应NACK重传
+        self.history = PacketHistory(VIDEO_HISTORY_SIZE)
+        # 初始化编码器，每层一个
+        self.codec_contexts = self._create_codec_contexts()
 
     def isRunning(self):
         return self._running
 
-    def _create_codec_context(self):
+    def _create_codec_contexts(self):
+        scale = self.bitrate_controller.scale
+        return [self._create_codec_context(width, height, int(bit_rate * scale))
+                for (width, height), (_, _, bit_rate) in zip(self.layer_sizes, VIDEO_SIMULCAST_LAYERS)]
+
+    def handle_feedback(self, message: dict):
+        """
+        control messages about our stream from receivers, called from the receiving thread
+        :param message: dict, a receiver report or a keyframe request
+        """
+        if message.get('type') == MessageType.RECEIVER_REPORT.value:
+            for report in message.get('streams', {}).values():
+                self.on_receiver_report(report)
+        elif message.get('type') == MessageType.KEYFRAME_REQUEST.value:
+            self.request_keyframe(message.get('layer'))
+        elif message.get('type') == MessageType.NACK.value:
+            self.retransmit(message.get('layer', len(VIDEO_SIMULCAST_LAYERS) - 1), message.get('frame_id'),
+                            message.get('sequences', []))
+
+    def retransmit(self, layer: int, frame_id: int, sequences: List[int]):
+        """
+        send again the chunks a receiver reported missing, if they are still in the history
+        """
+        datagrams = []
+        for sequence_number in sequences:
+            parts = self.history.get((layer, frame_id, sequence_number))
+            if parts is not None:
+                header, chunk = parts
+                datagrams.append((mark_retransmission(header), chunk))
+        with self.sock_lock:
+            for parts in datagrams:
+                self._send_parts(self.sock, parts, self.target_addr)
+
+    def request_keyframe(self, layer: int = None):
+        """
+        force a keyframe (IDR) on the next encoded frame
+        :param layer: int, simulcast layer, None for every layer
+        """
+        if layer is None:
+            self.keyframe_layers.update(range(len(VIDEO_SIMULCAST_LAYERS)))
+        elif 0 <= layer < len(VIDEO_SIMULCAST_LAYERS):
+            self.keyframe_layers.add(layer)
+
+    def on_receiver_report(self, report: dict):
+        """
+        feedback from a receiver of our stream, called from the receiving thread
+        :param report: dict, loss fraction, jitter and received bit rate of our stream
+        """
+        loss = float(report.get('loss', 0.0))
+        self.bitrate_controller.update(loss)
+        # 平滑后的丢包率决定每帧附加的校验块数量
+        self.loss_fraction += 0.5 * (loss - self.loss_fraction)
+
+    def _apply_bitrate(self):
+        """
+        follow the congestion controller: scale the bit rate of every layer, and below half of the
+        maximum rate also lower the frame rate, below a quarter halve the resolution.
+        The encoders are recreated (starting with a keyframe), so this is rate limited.
+        """
+        target = self.bitrate_controller.bitrate
+        now = time.time()
+        if abs(target - self._applied_bitrate) < 0.15 * self._applied_bitrate \
+                or now - self._last_reconfigure < VIDEO_RECONFIGURE_INTERVAL:
+            return
+        self._applied_bitrate = target
+        self._last_reconfigure = now
+        scale = self.bitrate_controller.scale
+        self.send_frame_rate = max(VIDEO_MIN_FRAME_RATE, round(self.frame_rate * min(1.0, 2 * scale)))
+        resolution = 1.0 if scale >= 0.25 else 0.5
+        # H.264 needs even dimensions
+        self.layer_sizes = [(int(width * resolution) // 2 * 2, int(height * resolution) // 2 * 2)
+                            for width, height, _ in VIDEO_SIMULCAST_LAYERS]
+        self.codec_contexts = self._create_codec_contexts()
+        print(f"[Info]: Video bit rate {target // 1000} kbit/s, {self.send_frame_rate} fps, {self.layer_sizes[-1]}")
+
+    def _create_codec_context(self, width: int = camera_width, height: int = camera_height,
+                              bit_rate: int = 2000000):
 
         # 创建内存缓冲区作为输出容器
         buffer = io.BytesIO()
         container = av.open(buffer, mode='w', format='h264')
 
         # 创建视频流
-        stream = container.add_stream('h264', rate=self.frame_rate)
-        stream.width = camera_width
-        stream.height = camera_height
+        stream = container.add_stream('h264', rate=self.send_frame_rate)
+        stream.width = width
+        stream.height = height
         stream.pix_fmt = 'yuv420p'
+        # 所有层的关键帧间隔相同，服务器只在关键帧处切换层
+        stream.codec_context.gop_size = self.send_frame_rate * VIDEO_KEYFRAME_INTERVAL
 
         # 设置编码器参数
         stream.options = {
             'preset': 'fast',  # 较快的编码速度
             'tune': 'zerolatency',  # 最低延迟
-            'x264-params': 'nal-hrd=cbr:force-cfr=1',  # 固定比特率
+            # 固定比特率；每个slice不超过一个数据块，丢一个包只丢一个slice
+            'x264-params': f'nal-hrd=cbr:force-cfr=1:slice-max-size={VIDEO_CHUNK_SIZE - 4}',
             'crf': '25',  # 压缩质量（0-51，23为默认值）
             'profile': 'baseline',  # 基准配置，更好的兼容性
             'level': '3.0'
         }
-        stream.bit_rate = 2000000  # 设置比特率为2Mbps
+        stream.bit_rate = bit_rate
         return stream
 
-    def _pack_data(self, *args):
-        data_len, sequence_number, data = args
-        return (struct.pack("I", len(self.client_id)) +
-                self.client_id +
-                struct.pack("Q", data_len) +
-                struct.pack("I", sequence_number) +
-                data)
+    @staticmethod
+    def _send_parts(sock: socket.socket, parts: Sequence, address: Tuple[str, int]):
+        """
+        send header and chunk as one datagram without joining them, Windows has no sendmsg
+        """
+        if hasattr(sock, 'sendmsg'):
+            sock.sendmsg(parts, [], 0, address)
+        else:
+            sock.sendto(b''.join(parts), address)
+
+    def _send_packet(self, layer: int, packet):
+        """
+        cut an encoded frame into MTU sized chunks at NAL unit boundaries and send them
+        :param layer: int, simulcast layer of the frame
+        :param packet: av.Packet
+        """
+        # 获取编码后的数据，数据块都是它的切片，不再复制
+        encoded_data = bytes(packet)
+        view = memoryview(encoded_data)
+        data_len = len(encoded_data)
+        flags = FLAG_KEYFRAME if packet.is_keyframe else 0
+        frame_id = self.frame_ids[layer]
+        self.frame_ids[layer] = (frame_id + 1) & 0xFFFFFFFF
+        timestamp = timestamp_ms()
+        # 按NAL单元分块，小的NAL合并，大的NAL拆分，每块不超过MTU
+        layout = packetize(encoded_data, VIDEO_CHUNK_SIZE)
+        num_chunks = len(layout)
+        chunks = [view[offset:offset + length] for offset, length, _ in layout]
+        # 有丢包时附加校验块，接收端无需重传即可恢复
+        parities = make_parity([(offset, chunk) for (offset, _, _), chunk in zip(layout, chunks)],
+                               parity_count(num_chunks, self.loss_fraction)) if VIDEO_FEC else []
+        layout += [(0, len(parity), 0) for parity in parities]
+
+        # 一帧的所有包头写进同一块缓冲区，历史记录引用其中的切片用于重传
+        size = header_size(self.client_id)
+        headers = memoryview(bytearray(size * len(layout)))
+        datagrams = []
+        for sequence_number, (chunk, (offset, _, nal_flags)) in enumerate(zip(chunks + parities, layout)):
+            position = sequence_number * size
+            pack_header_into(headers, position, self.client_id, layer, frame_id, sequence_number, timestamp,
+                             data_len, flags | nal_flags, num_chunks, len(parities), offset)
+            parts = (headers[position:position + size], chunk)
+            self.history.put((layer, frame_id, sequence_number), parts)
+            datagrams.append(parts)
+        # 整帧一次加锁发送
+        with self.sock_lock:
+            for parts in datagrams:
+                self._send_parts(self.sock, parts, self.target_addr)
 
     def _process_data(self):
         while self._running:
@@ -66,38 +203,32 @@ class VideoSender:
             ret, frame = self.camera.get_frame()
             if not ret:
                 continue
-            # 调整帧的分辨率
-            frame = cv2.resize(frame, (camera_width, camera_height))
-            # 转换为PyAV帧格式
-            av_frame = av.VideoFrame.from_ndarray(frame, format='rgb24')
+            self._apply_bitrate()
+            top_layer = len(self.codec_contexts) - 1
+            layers = range(top_layer + 1) if self.simulcast else [top_layer]
 
-            try:
-                # 编码帧
-                # encode似乎来自C扩展，PyCharm似乎无法识别，别在意这个警告
-                packets = self.codec_context.encode(av_frame)
-                # 一个packets里只有一帧数据
-                for packet in packets:
-                    # 获取编码后的数据
-                    encoded_data = bytes(packet)
-                    data_len = len(encoded_data)
-                    # 分块发送数据
-                    num_chunks = (data_len // VIDEO_CHUNK_SIZE) + 1
-                    sequence_number = 0
-
-                    for i in range(num_chunks):
-                        chunk = encoded_data[i * VIDEO_CHUNK_SIZE: (i + 1) * VIDEO_CHUNK_SIZE]
-                        packet = self._pack_data(data_len, sequence_number, chunk)
-                        with self.sock_lock:
-                            self.sock.sendto(packet, self.target_addr)
-                        self.loopback_sock.sendto(packet, ('127.0.0.1', self.sock.getsockname()[1]))
-                        sequence_number += 1
-
-            except Exception as e:
-                print(f"Encoding error: {e}")
-                continue
+            for layer in layers:
+                width, height = self.layer_sizes[layer]
+                try:
+                    # 调整帧的分辨率
+                    # 转换为PyAV帧格式
+                    av_frame = av.VideoFrame.from_ndarray(cv2.resize(frame, (width, height)), format='rgb24')
+                    if layer in self.keyframe_layers:
+                        # 接收端请求关键帧（丢包后解码器无法继续）
+                        self.keyframe_layers.discard(layer)
+                        av_frame.pict_type = PictureType.I
+                    # 编码帧
+                    # encode似乎来自C扩展，PyCharm似乎无法识别，别在意这个警告
+                    packets = self.codec_contexts[layer].encode(av_frame)
+                    # 一个packets里只有一帧数据
+                    for packet in packets:
+                        self._send_packet(layer, packet)
+                except Exception as e:
+                    print(f"Encoding error: {e}")
+                    continue
             elapse_time = time.time() - start_time
             # 控制帧率
-            time.sleep(max(1.0 / self.frame_rate - elapse_time, 0))
+            time.sleep(max(1.0 / self.send_frame_rate - elapse_time, 0))
 
     def start(self):
         if self._running:
@@ -111,25 +242,25 @@ class VideoSender:
         if self._thread:
             self._thread.join()
         # 刷新编码器缓冲区
-        if self.codec_context:
+        for layer, codec_context in enumerate(self.codec_contexts):
             try:
-                packets = self.codec_context.encode(None)
-                for packet in packets:
-                    encoded_data = bytes(packet)
-                    self.sock.sendto(self._pack_data(len(encoded_data), 0, encoded_data), self.target_addr)
+                for packet in codec_context.encode(None):
+                    self._send_packet(layer, packet)
             except Exception as e:
                 print(f"Error flushing encoder: {e}")
         if self.camera:
             self.camera.stop()
 
-    def reconnect(self, address: Tuple[str, int]):
+    def reconnect(self, address: Tuple[str, int], simulcast: bool = True):
         """
         重新连接到新的地址(服务器或者其他客户端)
         :param address:
+        :param simulcast: 是否发送所有分辨率层，只有服务器会为每个接收者挑选层
         :return:
         """
         with self.sock_lock:
             self.target_addr = address
+            self.simulcast = simulcast
 
     def switch_mode(self):
         """
@@ -144,7 +275,6 @@ class VideoSender:
         """
         if self._running:
             self.stop_running()
-        self.loopback_sock.close()
 
     def stop_video_send(self):
         """
@@ -155,4 +285,4 @@ class VideoSender:
         self.stop_running()
         self.camera = None
         self._thread = None
-        self.codec_context = self._create_codec_context()
\ No newline at end of file
+        self.codec_contexts = self._create_codec_contexts()
\ No newline at end of file
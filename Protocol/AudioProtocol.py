@@ -1,8 +1,9 @@
 import asyncio
 import json
 from asyncio import DatagramProtocol
-import numpy as np
-from config import MessageType, CHUNK
+
+from DataTransfer.Audio.AudioPacket import unpack_audio
+from config import MessageType, AUDIO_BITRATE, RATE
 
 
 class AudioProtocol(DatagramProtocol):
@@ -19,10 +20,18 @@ class AudioProtocol(DatagramProtocol):
                 client_id = request['client_id']
                 if request.get('type') == MessageType.INIT.value:
                     self.server.clients_addr['audio'][client_id] = addr
-                    self.server.mixed_audio_buffer[addr] = np.zeros(CHUNK, dtype=np.int16)
-            except (json.JSONDecodeError, KeyError):
+                    # clients declare the rate they capture at and the rate they want the mix in
+                    self.server.init_audio_codec(addr, request.get('codec', 'pcm'),
+                                                 request.get('bit_rate', AUDIO_BITRATE), request.get('fec', 0),
+                                                 request.get('rate', RATE), request.get('output_rate', RATE))
+            except (json.JSONDecodeError, KeyError, UnicodeDecodeError):
                 pass
             return
 
-        await self.server.handle_audio(data, addr)
+        try:
+            packet = unpack_audio(data)
+        except ValueError as e:
+            print(f"[Error]: {e} from {addr}")
+            return
+        await self.server.handle_audio(packet, addr)
 
@@ -2,6 +2,7 @@ import asyncio
 import json
 from asyncio import DatagramProtocol
 
+from DataTransfer.Video.VideoPacket import unpack_video, is_control
 from config import MessageType
 
 
@@ -21,7 +22,26 @@ class VideoProtocol(DatagramProtocol):
             except (json.JSONDecodeError, KeyError):
                 pass
             return
-        await self.server.handle_video(data, addr)
+        if is_control(data):
+            try:
+                request = json.loads(data.decode())
+                if request.get('type') == MessageType.RECEIVER_REPORT.value:
+                    self.server.handle_video_report(request, addr)
+                elif request.get('type') == MessageType.KEYFRAME_REQUEST.value:
+                    self.server.handle_keyframe_request(request, addr)
+                elif request.get('type') == MessageType.NACK.value:
+                    self.server.handle_nack(request, addr)
+                elif request.get('type') == MessageType.VIDEO_PAUSE.value:
+                    self.server.handle_video_pause(request, addr)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                pass
+            return
+        try:
+            packet = unpack_video(data)
+        except ValueError as e:
+            print(f"[Error]: {e} from {addr}")
+            return
+        await self.server.handle_video(data, packet, addr)
 
 
 
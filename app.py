@@ -3,9 +3,9 @@ import json
 import sys
 import traceback
 
-from PIL.Image import Image
 from PyQt5.QtCore import pyqtSignal, QObject
 
+from DataTransfer.Video.FrameMailbox import FrameMailbox
 from common.conf_client import ConferenceClient
 from component.audiopreview import AudioPreview
 from component.meetingcardgroup import MeetingCardsGroupHandler
@@ -84,7 +84,7 @@ class AppController(QObject):
 
     closed = pyqtSignal()
     message_received = pyqtSignal(str, str, str)  # sender_name, message, timestamp
-    video_received = pyqtSignal(Image)  # video
+    video_received = pyqtSignal()  # a new video frame waits in video_mailbox
     control_received = pyqtSignal(MessageType, str)  # for control message
 
     def __init__(self, mainui: Main, loginui: LoginWindow):
@@ -93,6 +93,8 @@ class AppController(QObject):
 
         self.mainui = mainui
         self.loginui = loginui
+        # 只保留最新一帧，GUI忙时旧帧被丢弃而不是排队
+        self.video_mailbox = FrameMailbox(self.video_received.emit)
         self.logincontol = LoginController(loginui, self)
         self.testcontrol = TestController(testui=self.mainui.testInterface, app=self)
         self.homecontrol = HomeController(homeui=self.mainui.homeInterface, app=self)
@@ -112,6 +114,15 @@ class AppController(QObject):
     def send_video_switch_mode(self):
         conf_client.switch_video_mode()
 
+    def set_video_view_size(self, width, height):
+        conf_client.set_video_view_size(width, height)
+
+    def set_video_visible(self, visible):
+        conf_client.set_video_visible(visible)
+
+    def scroll_video(self, pages):
+        conf_client.scroll_video(pages)
+
     def send_audio_start(self):
         conf_client.start_send_audio()
 
@@ -30,6 +30,9 @@ class ConferenceClient:
         self.recv_data = None  # you may need to save received streamd data from other clients in conference
         self.videoSender: VideoSender = None  # you may need to maintain multiple video senders for a single conference
         self.videoReceiver: VideoReceiver = None
+        self.video_view_size = (view_width, view_height)  # size of the widget video is shown in
+        self.video_visible = True  # False while the meeting window is minimised
+        self.participants: Dict[str, str] = {}  # self.participants[client_id] = username, pushed by the server
         self.audioSender: AudioSender = None
         self.audioReceiver: AudioReceiver = None
         self.update_signal = {dataType: None for dataType in self.support_data_types}  # signal for updating GUI
@@ -127,7 +130,7 @@ class ConferenceClient:
             'type': MessageType.QUIT.value,
             'client_id': self.userInfo.uuid,
         }
-        self.conns['text'].sendall(json.dumps(quit_request).encode())
+        self.conns['text'].sendall(pack_message(quit_request))
 
     def cancel_conference(self):
         """
@@ -166,98 +169,131 @@ class ConferenceClient:
             'timestamp': timestamp
         }
         connection = self.conns['p2p'] if self.is_p2p else self.conns['text']
-        connection.sendall(json.dumps(message_post).encode())
+        connection.sendall(pack_message(message_post))
 
     def recv_conference_task(self):
         """处理普通会议消息的接收任务"""
+        # 服务器会主动推送消息, 一次recv可能包含多条消息或半条消息
+        buffer = bytearray()
         while self.on_meeting:
             try:
-                _recv_data = self.conns['text'].recv(DATA_LINE_BUFFER)
+                data = self.conns['text'].recv(DATA_LINE_BUFFER)
             except ConnectionResetError:
                 print(f'[Info]: Server disconnected')
                 self.close_conference()
                 break
-            # 检查是否退出会议
-            if not _recv_data or _recv_data == b'Quitted' or _recv_data == b'Cancelled':
+            buffer += data
+            quitted = not data
+            for _recv_data in split_messages(buffer):
+                # 检查是否退出会议
+                if _recv_data == b'Quitted' or _recv_data == b'Cancelled':
+                    quitted = True
+                    break
+                self.handle_conference_message(_recv_data)
+            if quitted:
                 if self.update_signal.get('control'):
                     self.update_signal['control'].emit(MessageType.QUIT, '')
                 print(f'You have been quitted from the conference {self.conference_id}')
                 self.close_conference()
                 break
 
-            # 解析和处理消息
-            try:
-                message = json.loads(_recv_data.decode())
-
-                if message['type'] == MessageType.TEXT_MESSAGE.value:
-                    if self.update_signal.get('text'):
-                        self.update_signal['text'].emit(message['sender_name'], message['message'], message['timestamp'])
-                    print(f'{message["sender_name"]} ({message["timestamp"]}): {message["message"]}')
-
-                elif message['type'] == MessageType.SWITCH_TO_P2P.value:
-                    self.conns['p2p'] = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    self.conns['p2p'].bind(('0.0.0.0', 0))
-                    self.conns['text'].sendall(
-                        json.dumps({
-                            'type': MessageType.P2P_INFOS_NOTIFICATION.value,
-                            'client_id': self.userInfo.uuid,
-                            'p2p_info': self.conns['p2p'].getsockname()[1]
-                        }).encode())
-
-                elif message['type'] == MessageType.P2P_INFOS_NOTIFICATION.value:
-                    self.p2p_addr = {key: tuple(value) for key, value in message['peer_addr'].items()}
-                    self._switch_to_p2p()
-                    print(f'[Info]: Switch to P2P mode')
-
-                elif message['type'] == MessageType.SWITCH_TO_CS.value:
-                    # 仅当当前为P2P模式时才切换
-                    if not self.is_p2p:
-                        continue
-                    self._switch_to_cs()
-                    self.p2p_addr = {}
-                    if 'p2p' in self.conns:
-                        try:
-                            self.conns['p2p'].shutdown(socket.SHUT_RDWR)
-                            self.conns['p2p'].close()
-                        except socket.error as e:
-                            print(f"[Error]: Error closing connection: {e}")
-                    self.conns.pop('p2p', None)
-                    print(f'[Info]: Switch to CS mode')
-
-                else:
-                    print(f'[Error]: Received unknown data: {message}')
-
-            except (json.JSONDecodeError, KeyError, UnicodeDecodeError):
-                print(f'[Info]: Received Unknown data: {len(_recv_data)} bytes')
+    def handle_conference_message(self, _recv_data: bytes):
+        """
+        parse and handle one message received from the conference server
+        """
+        try:
+            message = json.loads(_recv_data.decode())
+
+            if message['type'] == MessageType.TEXT_MESSAGE.value:
+                if self.update_signal.get('text'):
+                    self.update_signal['text'].emit(message['sender_name'], message['message'], message['timestamp'])
+                print(f'{message["sender_name"]} ({message["timestamp"]}): {message["message"]}')
+
+            elif message['type'] == MessageType.SWITCH_TO_P2P.value:
+                self.conns['p2p'] = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.conns['p2p'].bind(('0.0.0.0', 0))
+                self.conns['text'].sendall(
+                    pack_message({
+                        'type': MessageType.P2P_INFOS_NOTIFICATION.value,
+                        'client_id': self.userInfo.uuid,
+                        'p2p_info': self.conns['p2p'].getsockname()[1]
+                    }))
+
+            elif message['type'] == MessageType.P2P_INFOS_NOTIFICATION.value:
+                self.p2p_addr = {key: tuple(value) for key, value in message['peer_addr'].items()}
+                self._switch_to_p2p()
+                print(f'[Info]: Switch to P2P mode')
+
+            elif message['type'] == MessageType.ACTIVE_SPEAKER.value:
+                if self.update_signal.get('control'):
+                    self.update_signal['control'].emit(MessageType.ACTIVE_SPEAKER, message['client_id'])
+                if self.videoReceiver:
+                    self.videoReceiver.set_active_speaker(message['client_id'])
+                print(f'[Info]: {self.participants.get(message["client_id"], message["client_id"])} is speaking')
+
+            elif message['type'] == MessageType.PARTICIPANTS.value:
+                participants = {participant['client_id']: participant['name'] for participant in message['participants']}
+                if self.videoReceiver:
+                    # 暂停显示的流不会超时，参会者离开时在这里移除
+                    for client_id in set(self.participants) - set(participants):
+                        self.videoReceiver.participant_left(client_id)
+                self.participants = participants
+                if self.update_signal.get('control'):
+                    # 信号只能带字符串, 参会者列表以JSON传递
+                    self.update_signal['control'].emit(MessageType.PARTICIPANTS, json.dumps(message['participants']))
+
+            elif message['type'] == MessageType.SWITCH_TO_CS.value:
+                # 仅当当前为P2P模式时才切换
+                if not self.is_p2p:
+                    return
+                self._switch_to_cs()
+                self.p2p_addr = {}
+                if 'p2p' in self.conns:
+                    try:
+                        self.conns['p2p'].shutdown(socket.SHUT_RDWR)
+                        self.conns['p2p'].close()
+                    except socket.error as e:
+                        print(f"[Error]: Error closing connection: {e}")
+                self.conns.pop('p2p', None)
+                print(f'[Info]: Switch to CS mode')
+
+            else:
+                print(f'[Error]: Received unknown data: {message}')
+
+        except (json.JSONDecodeError, KeyError, UnicodeDecodeError):
+            print(f'[Info]: Received Unknown data: {len(_recv_data)} bytes')
 
     def recv_p2p_task(self):
         """处理P2P消息的接收任务"""
         # 设置为非阻塞模式, 避免卡死
         self.conns['p2p'].setblocking(False)
+        buffer = bytearray()
         while self.on_meeting and self.is_p2p:
             try:
-                _recv_data = self.conns['p2p'].recv(DATA_LINE_BUFFER)
+                data = self.conns['p2p'].recv(DATA_LINE_BUFFER)
             except BlockingIOError:
                 continue
             except ConnectionResetError:
                 print(f'[Info]: Peer disconnected')
                 break
-            if not _recv_data:
+            if not data:
                 break
+            buffer += data
             # 解析和处理消息
-            try:
-                message = json.loads(_recv_data.decode())
+            for _recv_data in split_messages(buffer):
+                try:
+                    message = json.loads(_recv_data.decode())
 
-                if message['type'] == MessageType.TEXT_MESSAGE.value:
-                    if self.update_signal.get('text'):
-                        self.update_signal['text'].emit(message['sender_name'], message['message'], message['timestamp'])
-                    print(f'{message["sender_name"]}: {message["message"]}')
+                    if message['type'] == MessageType.TEXT_MESSAGE.value:
+                        if self.update_signal.get('text'):
+                            self.update_signal['text'].emit(message['sender_name'], message['message'], message['timestamp'])
+                        print(f'{message["sender_name"]}: {message["message"]}')
 
-                else:
-                    print(f'[Error]: Received unknown data: {message}')
+                    else:
+                        print(f'[Error]: Received unknown data: {message}')
 
-            except (json.JSONDecodeError, KeyError, UnicodeDecodeError):
-                print(f'[Info]: Received Unknown data: {len(_recv_data)} bytes')
+                except (json.JSONDecodeError, KeyError, UnicodeDecodeError):
+                    print(f'[Info]: Received Unknown data: {len(_recv_data)} bytes')
 
     def output_data(self):
         """
@@ -284,7 +320,10 @@ class ConferenceClient:
             self.recv_thread['p2p_text'].join()
             self.recv_thread.pop('p2p_text', None)
         if self.videoSender:
-            self.videoSender.reconnect(addr_dict['video'])
+            # 只有服务器需要所有分辨率层
+            self.videoSender.reconnect(addr_dict['video'], simulcast=not self.is_p2p)
+        if self.videoReceiver:
+            self.videoReceiver.reconnect(addr_dict['video'])
         if self.audioSender:
             self.audioSender.reconnect(addr_dict['audio'])
 
@@ -331,8 +370,11 @@ class ConferenceClient:
         self.recv_thread['text'].start()
 
         # Initialize video connection
-        self.videoReceiver = VideoReceiver(connections['video'], self.update_signal['video'])
         self.videoSender = VideoSender(None, connections['video'], self.userInfo.uuid, self.data_server_addr['video'])
+        self.videoReceiver = VideoReceiver(connections['video'], self.update_signal['video'],
+                                           self.data_server_addr['video'], self.videoSender.handle_feedback)
+        self.videoReceiver.set_view_size(*self.video_view_size)
+        self.videoReceiver.view_visible = self.video_visible
         self.videoReceiver.start()
 
         # Initialize audio connection
@@ -356,14 +398,21 @@ class ConferenceClient:
             # Send init request to servers
             init_request = {
                 'type': MessageType.INIT.value,
-                'client_id': self.userInfo.uuid
+                'client_id': self.userInfo.uuid,
+                'client_name': self.userInfo.username
             }
             time.sleep(0.3)
             for medium in ['text', 'video', 'audio']:
                 if medium == 'video':
                     self.conns[medium].sendto(json.dumps(init_request).encode(), addr_dict[medium])
                     continue
-                self.conns[medium].sendall(json.dumps(init_request).encode())
+                if medium == 'audio':
+                    # 在加入时告诉服务器使用的音频编码和采样率
+                    audio_request = dict(init_request, codec=AUDIO_CODEC, bit_rate=AUDIO_BITRATE,
+                                         fec=AUDIO_FEC_GROUP, rate=RATE, output_rate=AUDIO_OUTPUT_RATE)
+                    self.conns[medium].sendall(json.dumps(audio_request).encode())
+                    continue
+                self.conns[medium].sendall(pack_message(init_request))
 
             self.start_sender_and_receiver()
 
@@ -417,6 +466,29 @@ class ConferenceClient:
             return
         self.videoSender.switch_mode()
 
+    def set_video_view_size(self, width, height):
+        """
+        the video widget was resized, frames are scaled to it before they reach the GUI
+        """
+        self.video_view_size = (width, height)
+        if self.videoReceiver:
+            self.videoReceiver.set_view_size(width, height)
+
+    def set_video_visible(self, visible):
+        """
+        the video widget was shown or hidden, hidden video is only decoded at keyframes
+        """
+        self.video_visible = visible
+        if self.videoReceiver:
+            self.videoReceiver.set_view_visible(visible)
+
+    def scroll_video(self, pages):
+        """
+        page through the video grid when the participants do not fit on one page
+        """
+        if self.videoReceiver:
+            self.videoReceiver.scroll_tiles(pages)
+
     def start_video_sender(self, mode='camera'):
         """
         start video sender for sharing camera data
@@ -430,6 +502,7 @@ class ConferenceClient:
             return
         camera = Camera(mode)
         self.videoSender.camera = camera
+        self.videoReceiver.set_local_camera(camera)
         print(f'[Info]: Start video sender in {mode} mode')
         self.videoSender.start()
 
@@ -438,6 +511,7 @@ class ConferenceClient:
         stop video sender for sharing camera data
         """
         if self.videoSender and self.videoSender.isRunning():
+            self.videoReceiver.set_local_camera(None)
             self.videoSender.stop_video_send()
             print(f'[Info]: Stop video sender')
         else:
@@ -515,6 +589,6 @@ class ConferenceClient:
     def set_controller(self, app):
         self.update_signal = {
             'text': app.message_received,  # type: pyqtSignal(str, str, str)
-            'video': app.video_received,  # type: pyqtSignal(Image)
+            'video': app.video_mailbox,  # type: FrameMailbox
             'control': app.control_received  # type: pyqtSignal(MessageType, str)
         }  # {data_type: handler} for GUI update
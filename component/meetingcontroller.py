@@ -1,12 +1,12 @@
+import json
 from enum import Enum
 from typing import Union
 import time
 
-from PIL.Image import Image
 from PyQt5.QtCore import pyqtSignal, QObject
-from PyQt5.QtGui import QImage
 from qfluentwidgets import Action, FluentIcon
 
+from DataTransfer.Video.FrameMailbox import FrameMailbox
 from common.user import User
 from config import MessageType
 from view.meetingscreen import MeetingInterfaceBase
@@ -15,7 +15,7 @@ class MeetingController(QObject):
 
     closed = MeetingInterfaceBase.close_signal
     message_received = pyqtSignal(str, str, str) # sender_name, message, timestamp
-    video_received = pyqtSignal(Image)
+    video_received = pyqtSignal() # a new frame waits in app.video_mailbox
     control_received = pyqtSignal(MessageType, str) # message_type, message
 
     def __init__(self, meetingUI: MeetingInterfaceBase, app, user_view, isOwned: bool):
@@ -32,6 +32,7 @@ class MeetingController(QObject):
         self.isMuted = False
         self.isSpeaking = False
         self.video_mode = ''
+        self.participants = {} # client_id -> username
         # connect signal
         self.meetingUI.close_signal.connect(self.closed)
         self.meetingUI.commandBar.getCommandBar().share_signal.connect(self.handle_video_send)
@@ -40,6 +41,10 @@ class MeetingController(QObject):
         self.chatArea.sendButton.clicked.connect(self.handle_message_send)
         self.message_received.connect(self.handle_message)
         self.video_received.connect(self.handle_video)
+        self.displayArea.resized.connect(self.app.set_video_view_size)
+        self.displayArea.visibilityChanged.connect(self.app.set_video_visible)
+        self.displayArea.scrolled.connect(self.app.scroll_video)
+        self.control_received.connect(self.handle_control)
         self.audio_control.triggered.connect(self.handle_audio_toggle)
 
 
@@ -89,9 +94,25 @@ class MeetingController(QObject):
     def handle_message(self, sender_name, message, timestamp):
         self.chatArea.addMessage(sender_name, message, timestamp)
 
-    def handle_video(self, image: Image):
-        image = image.toqimage()
-        self.displayArea.set_image(image)
+    def handle_control(self, message_type: MessageType, message: str):
+        if message_type == MessageType.ACTIVE_SPEAKER:
+            # message is the client id of the speaker
+            self.displayArea.setSpeaker(self.participants.get(message, ''))
+            self.meetingUI.participantsArea.setActiveSpeaker(message)
+        elif message_type == MessageType.PARTICIPANTS:
+            participants = json.loads(message)
+            self.participants = {participant['client_id']: participant['name'] for participant in participants}
+            self.meetingUI.participantsArea.setParticipants(participants)
+
+    def handle_video(self):
+        # np.ndarray in QImage.Format_RGB32 layout, None when there is no video
+        frame = self.app.video_mailbox.take()
+        if frame is FrameMailbox.EMPTY:
+            return
+        if frame is None:
+            self.displayArea.setToDefault()
+        else:
+            self.displayArea.set_frame(frame)
 
     def handle_quit(self):
         self.app.send_video_stop()
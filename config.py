@@ -20,18 +20,63 @@ TIMEOUT_SERVER = 5
 LOG_INTERVAL = 2
 CONTROL_LINE_BUFFER = 1024
 DATA_LINE_BUFFER = 4096
+TEXT_DELIMITER = b'\n'  # Ends every message on the in-meeting text connections
 USER_INFO_FILE = 'user_info.json'
 CONFIG_INFO_FILE = 'config/appconfig.json'
-CHUNK = 4096  # Audio chunk size
 CHANNELS = 1  # Channels for audio capture
 RATE = 44100  # Sampling rate for audio capture
+AUDIO_FRAME_MS = 20  # Audio frame duration in ms, one of 10, 20, 40
+CHUNK = RATE * AUDIO_FRAME_MS // 1000  # Audio chunk size (samples per frame)
+AUDIO_OUTPUT_RATE = RATE  # Sampling rate the mix is received and played at, e.g. 16000 for voice only
+AUDIO_OUTPUT_CHUNK = AUDIO_OUTPUT_RATE * AUDIO_FRAME_MS // 1000  # Samples per played frame
+AUDIO_MIXER_RATE = 48000  # Internal sampling rate of the server mixer
 SAMPLE_SIZE = 16  # Sample size for audio capture
 CODE_C = 'audio/pcm'  # Codec for audio capture
+AUDIO_QUEUE_SIZE = 5  # Frames buffered per sender in the server mixer
+AUDIO_JITTER_MIN_DELAY = 40  # Minimum playout delay of the audio jitter buffer in ms
+AUDIO_JITTER_MAX_DELAY = 300  # Maximum playout delay of the audio jitter buffer in ms
+AUDIO_MAX_CONCEAL = 5  # Consecutive missing audio frames concealed before rebuffering
+AUDIO_VAD_THRESHOLD = 9  # Level above the noise floor in dB for a frame to count as speech
+AUDIO_VAD_HANGOVER = 300  # Time in ms speech is held after the last active frame
+AUDIO_KEEPALIVE_INTERVAL = 1.0  # Seconds between comfort noise packets while not transmitting
+ACTIVE_SPEAKER_SMOOTHING = 300  # Time constant in ms of the level used for active speaker detection
+ACTIVE_SPEAKER_HYSTERESIS = 6  # dB a challenger must be louder than the active speaker to take over
+ACTIVE_SPEAKER_HOLD = 1000  # Time in ms a challenger must stay louder to take over
+ACTIVE_SPEAKER_COUNT = 3  # Number of ranked active speakers sent to clients
+AUDIO_FEC_GROUP = 4  # Audio packets protected by one XOR parity packet, 0 disables FEC
+AUDIO_CODEC = 'opus'  # Codec for audio transmission, 'pcm' for raw 16-bit PCM
+AUDIO_BITRATE = 24000  # Bitrate for encoded audio
 SUCCESSFUL = True
 FAILED = False
 camera_width, camera_height = 640, 360   # resolution for camera and screen capture
-VIDEO_CHUNK_SIZE = 8192  # UDP  # UDP
+VIDEO_CHUNK_SIZE = 1200  # Largest video payload per datagram, the whole datagram stays below a 1500 byte MTU
+VIDEO_FRAME_RATE = 20  # Frames per second sent by VideoSender
+# (width, height, bit rate) of each simulcast layer, lowest first
+VIDEO_SIMULCAST_LAYERS = [(camera_width // 4, camera_height // 4, 150000),
+                          (camera_width // 2, camera_height // 2, 500000),
+                          (camera_width, camera_height, 2000000)]
+VIDEO_KEYFRAME_INTERVAL = 2  # Seconds between keyframes, the server only switches layers on a keyframe
+VIDEO_REPORT_INTERVAL = 1.0  # Seconds between receiver reports sent to the server
+VIDEO_DOWNLINK_BANDWIDTH = 4000000  # Maximum video downlink in bit/s a receiver reports, shared by all the streams it receives
+VIDEO_SPEAKER_SHARE = 3  # Shares of the downlink an active speaker's stream gets, the other streams get one
+VIDEO_LOSS_HIGH = 0.10  # Loss fraction above which the video bit rate is cut
+VIDEO_LOSS_LOW = 0.02  # Loss fraction below which the video bit rate is raised
+VIDEO_MIN_BITRATE = 100000  # Lowest bit rate in bit/s the congestion controller goes down to
+VIDEO_MIN_FRAME_RATE = 5  # Lowest frame rate the congestion controller goes down to
+VIDEO_RECONFIGURE_INTERVAL = 2.0  # Minimum seconds between two encoder reconfigurations
+VIDEO_KEYFRAME_REQUEST_INTERVAL = 0.5  # Minimum seconds between two keyframe requests for the same stream
+VIDEO_FRAME_DEADLINE = 0.3  # Seconds an incomplete frame waits for missing chunks before it is given up
+VIDEO_NACK_INTERVAL = 0.1  # Seconds before missing chunks of the same frame are asked for again
+VIDEO_NACK_RETRIES = 2  # Times the missing chunks of a frame are asked for
+VIDEO_HISTORY_SIZE = 8192  # Sent video chunks VideoSender keeps for retransmission
+VIDEO_FORWARD_CACHE_SIZE = 32768  # Forwarded video chunks the server keeps to answer NACKs itself
+VIDEO_FEC = True  # Send XOR parity chunks with every video frame while receivers report loss
+VIDEO_FEC_MAX_RATIO = 0.5  # Most parity chunks sent per data chunk of a frame
+VIDEO_DECODE_THREADS = 4  # Decode workers shared by all the received video streams
+VIDEO_DECODE_QUEUE_SIZE = 3  # Encoded frames a stream may queue for decoding before it drops to catch up
 view_width, view_height = 960, 540  # resolution for video display
+VIDEO_DISPLAY_RATE = 60  # Most times per second the video grid is handed to the display
+VIDEO_MAX_TILES = 9  # Participants on one page of the video grid, the streams of the other pages are paused
 
 
 class MessageType(Enum):
@@ -48,6 +93,12 @@ class MessageType(Enum):
     SWITCH_TO_P2P = 'switch_to_p2p'
     SWITCH_TO_CS = 'switch_to_cs'
     P2P_INFOS_NOTIFICATION = 'p2p_infos_notification'
+    ACTIVE_SPEAKER = 'active_speaker'
+    PARTICIPANTS = 'participants'
+    RECEIVER_REPORT = 'receiver_report'
+    KEYFRAME_REQUEST = 'keyframe_request'
+    NACK = 'nack'
+    VIDEO_PAUSE = 'video_pause'
 
 class Status(Enum):
     SUCCESS = True
@@ -3,6 +3,7 @@ Simple util implementation for video conference
 Including data capture, image compression and image overlap
 Note that you can use your own implementation as well :)
 """
+import json
 import socket
 import uuid
 from io import BytesIO
@@ -35,7 +36,9 @@ audio = pyaudio.PyAudio()
 
 try:
     streamin = audio.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
-    streamout = audio.open(format=FORMAT, channels=CHANNELS, rate=RATE, output=True, frames_per_buffer=CHUNK)
+    # the server resamples the mix to the output rate, which may be lower than the capture rate
+    streamout = audio.open(format=FORMAT, channels=CHANNELS, rate=AUDIO_OUTPUT_RATE, output=True,
+                           frames_per_buffer=AUDIO_OUTPUT_CHUNK)
 except Exception as e:
     print(e)
     streamin = None
@@ -53,6 +56,24 @@ else:
 my_screen_size = pyautogui.size()
 
 
+def pack_message(message: Dict[str, Any]) -> bytes:
+    """
+    frame a JSON message for the in-meeting text connections, which carry a stream of messages
+    """
+    return json.dumps(message).encode() + TEXT_DELIMITER
+
+
+def split_messages(buffer: bytearray) -> List[bytes]:
+    """
+    take the complete messages out of the bytes received so far on a text connection
+    :param buffer: bytearray, received bytes, the incomplete last message is left in it
+    :return: list of bytes, the messages without their delimiter
+    """
+    *messages, rest = bytes(buffer).split(TEXT_DELIMITER)
+    buffer[:] = rest
+    return [message for message in messages if message]
+
+
 def resize_image_to_fit_screen(image, my_screen_size):
     screen_width, screen_height = my_screen_size
 
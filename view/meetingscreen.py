@@ -2,7 +2,7 @@ import math
 import sys
 from enum import Enum
 
-from PyQt5.QtCore import Qt, QRectF, pyqtSignal, QSize
+from PyQt5.QtCore import Qt, QRectF, pyqtSignal, QSize, QEvent
 from PyQt5.QtGui import QFont, QColor, QIcon, QImage, QPainter, QPainterPath
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QGridLayout, QFrame, QSizePolicy, \
     QApplication, QHBoxLayout, QPushButton, QTextBrowser, QActionGroup
@@ -94,6 +94,10 @@ class SpeakerWidget(QWidget):
 
 class ViewWidget(QWidget):
 
+    resized = pyqtSignal(int, int) # width, height, video frames are scaled to it before they arrive
+    visibilityChanged = pyqtSignal(bool) # False while hidden or minimised, hidden video is not decoded
+    scrolled = pyqtSignal(int) # pages to turn, the wheel pages through the participants that do not fit
+
     def __init__(self, parent=None):
         super().__init__(parent=parent)
 
@@ -102,6 +106,9 @@ class ViewWidget(QWidget):
         self.speakerLabel = SpeakerWidget(self) # bottom right corner
         self.painter = None # QPainter
         self.currentImage = self.defaultImage() # QImage
+        self.currentFrame = None # np.ndarray the QImage wraps, kept alive while it is shown
+        self.videoVisible = True
+        self.wheelDelta = 0 # wheel rotation not yet turned into pages, touchpads scroll in small steps
         self.painterPath = None # QPainterPath
 
         self.mainLayout = QVBoxLayout(self)
@@ -122,6 +129,7 @@ class ViewWidget(QWidget):
 
     def setToDefault(self):
         self.currentImage = self.defaultImage()
+        self.currentFrame = None
         self.update()
 
     def init_brush(self):
@@ -141,8 +149,50 @@ class ViewWidget(QWidget):
 
     def set_image(self, image):
         self.currentImage = self.fit_image(image)
+        self.currentFrame = None
+        self.update()
+
+    def set_frame(self, frame):
+        # frame is already scaled to the widget in RGB32 layout, wrap it without a copy
+        height, width = frame.shape[:2]
+        self.currentFrame = frame
+        self.currentImage = QImage(frame.data, width, height, frame.strides[0], QImage.Format_RGB32)
         self.update()
 
+    def resizeEvent(self, e):
+        super().resizeEvent(e)
+        self.resized.emit(self.width(), self.height())
+
+    def showEvent(self, e):
+        super().showEvent(e)
+        # minimising the window does not hide its children, watch its state instead
+        self.window().installEventFilter(self)
+        self.updateVisibility()
+
+    def hideEvent(self, e):
+        super().hideEvent(e)
+        self.updateVisibility()
+
+    def eventFilter(self, obj, e):
+        if obj is self.window() and e.type() == QEvent.WindowStateChange:
+            self.updateVisibility()
+        return super().eventFilter(obj, e)
+
+    def updateVisibility(self):
+        visible = self.isVisible() and not self.window().isMinimized()
+        if visible != self.videoVisible:
+            self.videoVisible = visible
+            self.visibilityChanged.emit(visible)
+
+    def wheelEvent(self, e):
+        self.wheelDelta += e.angleDelta().y()
+        pages = int(self.wheelDelta / 120)
+        if pages:
+            self.wheelDelta -= pages * 120
+            # scrolling down shows the next page
+            self.scrolled.emit(-pages)
+        e.accept()
+
     def setSpeaker(self, name):
         self.speakerLabel.setName(name)
 
@@ -368,24 +418,52 @@ class ParticipantCardView(HeaderCardWidget):
         self.mainLayout.addStretch(1)
         self.mainLayout.addWidget(self.scrollView, alignment=Qt.AlignCenter)
 
-        self.participantUnit = [] # list['ViewUnit']
+        self.participantUnit = {} # client_id -> 'ViewUnit', names may repeat
 
         self.setMinimumSize(260, 300)
 
         self.scrollView.move(5, 50)
 
 
-    def addUnit(self, name, avatar_img):
+    AVATARS = [":/avatar/avatar_0.png", ":/avatar/avatar_1.png", ":/avatar/avatar_2.png"]
+
+    def addUnit(self, client_id, name, avatar_img):
         unit = self.ViewUnit(name, avatar_img, self.participantGrid)
         unit.setFixedSize(70, 70)
         self.bodyLayout.addWidget(unit, self.bodyLayout.rowCount(), 0, alignment=Qt.AlignCenter)
-        self.participantUnit.append(unit)
+        self.participantUnit[client_id] = unit
         self.update()
 
+    def removeUnit(self, client_id):
+        unit = self.participantUnit.pop(client_id, None)
+        if unit:
+            self.bodyLayout.removeWidget(unit)
+            unit.deleteLater()
+            self.update()
+
+    def setParticipants(self, participants):
+        """
+        participants: list of {'client_id', 'name'} in the order they joined
+        """
+        client_ids = [participant['client_id'] for participant in participants]
+        for client_id in list(self.participantUnit):
+            if client_id not in client_ids:
+                self.removeUnit(client_id)
+        for participant in participants:
+            if participant['client_id'] not in self.participantUnit:
+                avatar = self.AVATARS[len(self.participantUnit) % len(self.AVATARS)]
+                self.addUnit(participant['client_id'], participant['name'], avatar)
+
+    def setActiveSpeaker(self, client_id):
+        for unit_id, unit in self.participantUnit.items():
+            unit.setActive(unit_id == client_id)
+
     class ViewUnit(QFrame):
         def __init__(self, name, avatar_img, parent=None):
             super().__init__(parent=parent)
 
+            self.name = name
+
             self.mainLayout = QVBoxLayout(self)
             self.mainLayout.setContentsMargins(0, 0, 0, 0)
             self.mainLayout.setSpacing(3)
@@ -405,6 +483,12 @@ class ParticipantCardView(HeaderCardWidget):
                 }
             """)
 
+        def setActive(self, isActive):
+            """
+            highlight the name of the participant who is speaking
+            """
+            self.nameLabel.setStyleSheet("color: #009faa; font-weight: bold;" if isActive else "")
+
 class ChatCardView(HeaderCardWidget):
 
     MAX_MESSAGE = 50